@@ -0,0 +1,659 @@
+#!/usr/bin/env python
+# Benchmarks of the scrape, pricing and render hot paths.
+#
+# Every benchmark runs against synthetic data sized at a multiple of today's
+# instance type and region counts (see BASE_INSTANCE_TYPES and BASE_REGIONS).
+# The EC2 API calls are replayed from a synthetic fixture bundle (see
+# fixtures.py), so nothing goes over the network. Each benchmark runs in a
+# fresh process so its peak memory can be measured, and the results are
+# written as JSON for comparing runs:
+#
+#   python benchmark.py --scales 1,5,20 --output benchmark.json
+#   python benchmark.py --baseline benchmark.json --output new.json
+#
+# With --baseline, the run fails if a benchmark got slower than the baseline
+# by more than --tolerance.
+import argparse
+import datetime
+import json
+import multiprocessing
+import os
+import platform
+import random
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import redirect_stdout
+
+import cache
+import ec2
+import fixtures
+import prices
+import rds
+import render
+import scrape
+from detail_pages_ec2 import build_detail_pages_ec2
+
+ROOT = os.path.abspath(os.path.dirname(__file__))
+
+# Roughly today's numbers of instance types per service and of regions with
+# prices. Regions can't be scaled past the ones botocore knows about, as every
+# scraper maps pricing locations to regions through its endpoint data.
+BASE_INSTANCE_TYPES = {"ec2": 750, "rds": 300, "cache": 90}
+BASE_REGIONS = 30
+
+# (size, vCPUs, GiB of memory) of the members of a synthetic family
+SIZES = [
+    ("medium", 1, 4),
+    ("large", 2, 8),
+    ("xlarge", 4, 16),
+    ("2xlarge", 8, 32),
+    ("4xlarge", 16, 64),
+    ("8xlarge", 32, 128),
+    ("16xlarge", 64, 256),
+    ("metal", 96, 384),
+]
+FAMILY_LETTERS = "cmrtixz"
+
+# (operatingSystem, preInstalledSw, spot ProductDescription) of the EC2 offers
+EC2_PLATFORMS = [
+    ("Linux", "NA", "Linux/UNIX"),
+    ("Windows", "NA", "Windows"),
+    ("RHEL", "NA", "Red Hat Enterprise Linux"),
+]
+RDS_ENGINES = [
+    ("2", "MySQL"),
+    ("14", "PostgreSQL"),
+    ("16", "Aurora MySQL"),
+    ("21", "Aurora PostgreSQL"),
+    ("18", "MariaDB"),
+]
+CACHE_ENGINES = ["Redis", "Memcached"]
+PURCHASE_OPTIONS = ["All Upfront", "Partial Upfront", "No Upfront"]
+
+DEFAULT_SCALES = "1,5,20"
+DEFAULT_OUTPUT = "benchmark.json"
+DEFAULT_TOLERANCE = 0.25
+
+
+def instance_types(prefix, count):
+    """count instance type names, in families of len(SIZES) members"""
+    names = []
+    for n in range(count):
+        family, member = divmod(n, len(SIZES))
+        letter = FAMILY_LETTERS[family % len(FAMILY_LETTERS)]
+        generation = family // len(FAMILY_LETTERS) + 1
+        names.append("%s%s%d.%s" % (prefix, letter, generation, SIZES[member][0]))
+    return names
+
+
+def _size(instance_type):
+    return SIZES[[s[0] for s in SIZES].index(instance_type.split(".")[-1])]
+
+
+def _hourly(rng, instance_type):
+    return round(_size(instance_type)[1] * rng.uniform(0.02, 0.06), 4)
+
+
+def _ondemand_terms(sku, hourly, description):
+    code = sku + ".JRTCKXETXF"
+    return {
+        code: {
+            "sku": sku,
+            "termAttributes": {},
+            "priceDimensions": {
+                code
+                + ".6YS6EN2CT7": {
+                    "unit": "Hrs",
+                    "description": description,
+                    "pricePerUnit": {"USD": "%.10f" % hourly},
+                }
+            },
+        }
+    }
+
+
+def _reserved_terms(sku, hourly, offering_classes):
+    """The reserved terms of a SKU, as they appear in the AWS price lists"""
+    terms = {}
+    for offering_class in offering_classes:
+        for lease, years in (("1yr", 1), ("3yr", 3)):
+            for n, option in enumerate(PURCHASE_OPTIONS):
+                code = "%s.%s%s%d" % (sku, offering_class or "", lease, n)
+                total = hourly * 24 * 365 * years * (0.6 if years == 1 else 0.4)
+                upfront = {"All Upfront": 1.0, "Partial Upfront": 0.5}.get(option, 0)
+                dimensions = {
+                    code
+                    + ".6YS6EN2CT7": {
+                        "unit": "Hrs",
+                        "description": "Reserved instance hours",
+                        "pricePerUnit": {
+                            "USD": "%.10f"
+                            % ((1 - upfront) * total / (24 * 365 * years))
+                        },
+                    }
+                }
+                if upfront:
+                    dimensions[code + ".2TG2D8R56U"] = {
+                        "unit": "Quantity",
+                        "description": "Upfront Fee",
+                        "pricePerUnit": {"USD": "%.0f" % (upfront * total)},
+                    }
+                attributes = {"LeaseContractLength": lease, "PurchaseOption": option}
+                if offering_class:
+                    attributes["OfferingClass"] = offering_class
+                terms[code] = {
+                    "sku": sku,
+                    "termAttributes": attributes,
+                    "priceDimensions": dimensions,
+                }
+    return terms
+
+
+def _instance_pricing(rng, instance_type, regions):
+    """Scraped EC2 pricing of an instance type, as found in instances.json"""
+    pricing = {}
+    for region in regions:
+        pricing[region] = {}
+        for operating_system, software, _ in EC2_PLATFORMS:
+            hourly = _hourly(rng, instance_type)
+            reserved = {}
+            for code, term in _reserved_terms("", hourly, ["standard"]).items():
+                upfront = hours = 0.0
+                for dimension in term["priceDimensions"].values():
+                    price = float(dimension["pricePerUnit"]["USD"])
+                    if dimension["unit"] == "Hrs":
+                        hours = price
+                    else:
+                        upfront = price
+                attributes = term["termAttributes"]
+                years = int(attributes["LeaseContractLength"][0])
+                reserved[ec2.translate_reserved_terms(attributes)] = (
+                    prices.format_price(upfront / (365 * years) / 24 + hours)
+                )
+            spot = hourly * rng.uniform(0.2, 0.5)
+            platform_name = ec2.translate_platform_name(operating_system, software)
+            pricing[region][platform_name] = {
+                "ondemand": prices.format_price(hourly),
+                "reserved": reserved,
+                "spot_min": prices.format_price(spot * 0.9),
+                "spot_max": prices.format_price(spot),
+            }
+    return pricing
+
+
+def _ec2_instance(rng, instance_type, regions):
+    _, vcpus, memory = _size(instance_type)
+    i = scrape.Instance()
+    i.instance_type = instance_type
+    i.family = rng.choice(["General purpose", "Compute optimized", "Memory optimized"])
+    i.pretty_name = instance_type.upper()
+    i.generation = "current"
+    i.arch = ["x86_64"]
+    i.vCPU = vcpus
+    i.memory = float(memory)
+    i.ECU = float(vcpus * 3)
+    i.physical_processor = "Intel Xeon Platinum 8124M"
+    i.clock_speed_ghz = "3 GHz"
+    i.intel_avx = i.intel_avx2 = i.intel_turbo = True
+    i.network_performance = rng.choice(["Up to 10 Gigabit", "25 Gigabit"])
+    i.enhanced_networking = True
+    i.ebs_optimized = True
+    i.ebs_max_bandwidth = 4750.0
+    i.ebs_throughput = 593.75
+    i.ebs_iops = 20000.0
+    i.vpc = {"max_enis": 4, "ips_per_eni": 15}
+    i.linux_virtualization_types = ["HVM"]
+    if instance_type[0] == "i":
+        i.ebs_only = False
+        i.ssd = i.nvme_ssd = True
+        i.num_drives = 1
+        i.drive_size = 75 * vcpus
+        i.size_unit = "GB"
+    i.availability_zones = {region: [region + "a", region + "b"] for region in regions}
+    i.pricing = _instance_pricing(rng, instance_type, regions)
+    return i
+
+
+class Dataset(object):
+    """Synthetic input data of all benchmarks at one scale, stored in workdir.
+
+    workdir is also where the benchmarks run, the templates and metadata they
+    read are linked in from the repository.
+    """
+
+    def __init__(self, workdir, scale):
+        self.workdir = workdir
+        self.scale = scale
+        # us-east-1 first, it is the region embedded in the pages
+        known = sorted(
+            ec2.get_region_descriptions().items(),
+            key=lambda r: (r[1] != render.DEFAULT_REGION, r[1]),
+        )
+        count = max(1, min(len(known), int(round(BASE_REGIONS * scale))))
+        self.locations = known[:count]
+        self.regions = [region for _, region in self.locations]
+        self.instance_types = {}
+        for service, prefix in (("ec2", ""), ("rds", "db."), ("cache", "cache.")):
+            count = max(1, int(round(BASE_INSTANCE_TYPES[service] * scale)))
+            self.instance_types[service] = instance_types(prefix, count)
+        self.instances_file = os.path.join(workdir, "data", "instances.json")
+        self.fixture_bundle = os.path.join(workdir, "data", "fixtures.zip")
+        self.offer_files = {
+            service: os.path.join(workdir, "data", "%s-offers.json" % service)
+            for service in ("rds", "cache")
+        }
+        # Number of records each benchmark processes, set by generate()
+        self.counts = {}
+
+    def generate(self):
+        os.makedirs(os.path.join(self.workdir, "data"), exist_ok=True)
+        os.makedirs(os.path.join(self.workdir, "www", "aws", "ec2"), exist_ok=True)
+        for name in ("in", "meta", "community_contributions.yaml"):
+            path = os.path.join(self.workdir, name)
+            if not os.path.exists(path):
+                os.symlink(os.path.join(ROOT, name), path)
+
+        self.write_instances()
+        self.write_fixture_bundle()
+        for service, engines in (("rds", RDS_ENGINES), ("cache", CACHE_ENGINES)):
+            self.write_offer_file(service, engines)
+
+    def write_instances(self):
+        rng = random.Random(1)
+        instances = [
+            _ec2_instance(rng, instance_type, self.regions).to_dict()
+            for instance_type in self.instance_types["ec2"]
+        ]
+        with open(self.instances_file, "w") as f:
+            json.dump(instances, f)
+        self.counts["instances"] = len(instances)
+
+    def write_fixture_bundle(self):
+        """Record the EC2 API responses add_pricing() will ask for"""
+        rng = random.Random(2)
+        types = self.instance_types["ec2"]
+        bundle = fixtures.FixtureBundle(self.fixture_bundle, "record")
+        service = {"ServiceCode": "AmazonEC2"}
+
+        key = fixtures.boto_key(
+            "pricing",
+            "us-east-1",
+            "GetAttributeValues",
+            dict(service, AttributeName="location"),
+        )
+        values = [{"Value": location} for location, _ in self.locations]
+        bundle.record_boto(key, 200, {"AttributeValues": values})
+
+        offers = 0
+        for location, region in self.locations:
+            price_list = []
+            for instance_type in types:
+                for operating_system, software, _ in EC2_PLATFORMS:
+                    sku = "%s.%s.%s" % (region, instance_type, operating_system)
+                    hourly = _hourly(rng, instance_type)
+                    offer = {
+                        "serviceCode": "AmazonEC2",
+                        "product": {
+                            "sku": sku,
+                            "productFamily": "Compute Instance",
+                            "attributes": {
+                                "instanceType": instance_type,
+                                "location": location,
+                                "operatingSystem": operating_system,
+                                "preInstalledSw": software,
+                                "tenancy": "Shared",
+                                "capacitystatus": "Used",
+                                "licenseModel": "No License required",
+                            },
+                        },
+                        "terms": {
+                            "OnDemand": _ondemand_terms(
+                                sku, hourly, "On Demand instance hours"
+                            ),
+                            "Reserved": _reserved_terms(
+                                sku, hourly, ["standard", "convertible"]
+                            ),
+                        },
+                    }
+                    price_list.append(json.dumps(offer))
+            filters = ec2.PRICING_FILTERS + [
+                {"Type": "TERM_MATCH", "Field": "location", "Value": location}
+            ]
+            key = fixtures.boto_key(
+                "pricing", "us-east-1", "GetProducts", dict(service, Filters=filters)
+            )
+            bundle.record_boto(key, 200, {"PriceList": price_list})
+            offers += len(price_list)
+        self.counts["offers"] = offers
+
+        now = datetime.datetime.now(datetime.timezone.utc)
+        records = 0
+        for region in self.regions:
+            history = []
+            for instance_type in types:
+                for _, _, description in EC2_PLATFORMS:
+                    for zone in "ab":
+                        history.append(
+                            {
+                                "AvailabilityZone": region + zone,
+                                "InstanceType": instance_type,
+                                "ProductDescription": description,
+                                "SpotPrice": "%.6f" % _hourly(rng, instance_type),
+                                "Timestamp": now,
+                            }
+                        )
+            params = {"InstanceTypes": types, "StartTime": now}
+            key = fixtures.boto_key("ec2", region, "DescribeSpotPriceHistory", params)
+            bundle.record_boto(key, 200, {"SpotPriceHistory": history})
+            records += len(history)
+        self.counts["spot_prices"] = records
+        bundle.close()
+
+    def _offer_skus(self, service, engines):
+        rng = random.Random(3)
+        family = {"rds": "Database Instance", "cache": "Cache Instance"}[service]
+        deployments = ["Single-AZ", "Multi-AZ"] if service == "rds" else [None]
+        for instance_type in self.instance_types[service]:
+            _, vcpus, memory = _size(instance_type)
+            for location, region in self.locations:
+                for engine in engines:
+                    code = engine[0] if service == "rds" else engine
+                    for deployment in deployments:
+                        sku = "%s.%s.%s.%s" % (region, instance_type, code, deployment)
+                        attributes = {
+                            "location": location,
+                            "locationType": "AWS Region",
+                            "instanceType": instance_type,
+                            "instanceFamily": "General purpose",
+                            "memory": "%d GiB" % memory,
+                            "vcpu": str(vcpus),
+                            "networkPerformance": "Up to 10 Gigabit",
+                            "usagetype": "InstanceUsage:" + instance_type,
+                            "operation": "CreateDBInstance",
+                        }
+                        if service == "rds":
+                            attributes.update(
+                                engineCode=engine[0],
+                                databaseEngine=engine[1],
+                                deploymentOption=deployment,
+                                licenseModel="No license required",
+                                databaseEdition="Standard",
+                            )
+                        else:
+                            attributes["cacheEngine"] = engine
+                        product = {
+                            "sku": sku,
+                            "productFamily": family,
+                            "attributes": attributes,
+                        }
+                        yield sku, product, _hourly(rng, instance_type)
+
+    def write_offer_file(self, service, engines):
+        """Write an offer file in the format of the AWS bulk price lists.
+
+        The file is written section by section, so no more than one SKU is
+        held in memory however large the file gets.
+        """
+        skus = 0
+        with open(self.offer_files[service], "w") as f:
+            f.write(
+                '{"formatVersion": "v1.0", "offerCode": "%s", "products": {' % service
+            )
+            for n, (sku, product, _) in enumerate(self._offer_skus(service, engines)):
+                f.write(
+                    "%s\n%s: %s"
+                    % ("," if n else "", json.dumps(sku), json.dumps(product))
+                )
+                skus += 1
+            f.write('}, "terms": {"OnDemand": {')
+            for n, (sku, _, hourly) in enumerate(self._offer_skus(service, engines)):
+                terms = _ondemand_terms(sku, hourly, "per On Demand instance hour")
+                f.write(
+                    "%s\n%s: %s"
+                    % ("," if n else "", json.dumps(sku), json.dumps(terms))
+                )
+            f.write('}, "Reserved": {')
+            for n, (sku, _, hourly) in enumerate(self._offer_skus(service, engines)):
+                terms = _reserved_terms(sku, hourly, [None])
+                f.write(
+                    "%s\n%s: %s"
+                    % ("," if n else "", json.dumps(sku), json.dumps(terms))
+                )
+            f.write("}}}")
+        self.counts[service + "_skus"] = skus
+
+    def ec2_imap(self, regions=False):
+        imap = {}
+        for instance_type in self.instance_types["ec2"]:
+            imap[instance_type] = i = scrape.Instance()
+            i.instance_type = instance_type
+            if regions:
+                i.pricing = {region: {} for region in self.regions}
+        return imap
+
+    def load_instances(self):
+        with open(self.instances_file) as f:
+            return json.load(f)
+
+
+# Every benchmark takes a generated Dataset and returns the callable to time
+# and the number of records it processes. Anything done before returning is
+# setup and is not timed.
+
+
+def bench_add_pricing(dataset):
+    fixtures.activate(dataset.fixture_bundle, "replay")
+    imap = dataset.ec2_imap()
+    return lambda: ec2.add_pricing(imap), dataset.counts["offers"]
+
+
+def bench_add_spot_pricing(dataset):
+    fixtures.activate(dataset.fixture_bundle, "replay")
+    imap = dataset.ec2_imap(regions=True)
+    return lambda: ec2.add_spot_pricing(imap), dataset.counts["spot_prices"]
+
+
+def bench_rds_scrape(dataset):
+    return (
+        lambda: rds.scrape("out/rds.json", dataset.offer_files["rds"]),
+        dataset.counts["rds_skus"],
+    )
+
+
+def bench_cache_scrape(dataset):
+    return (
+        lambda: cache.scrape("out/cache.json", dataset.offer_files["cache"]),
+        dataset.counts["cache_skus"],
+    )
+
+
+def bench_compress_pricing(dataset):
+    instances = dataset.load_instances()
+    return lambda: render.compress_pricing(instances), len(instances)
+
+
+def bench_render(dataset):
+    # Not www/instances.json, so the detail pages are left out
+    return (
+        lambda: render.render(
+            dataset.instances_file, "in/index.html.mako", "out/index.html"
+        ),
+        dataset.counts["instances"],
+    )
+
+
+def bench_detail_pages_ec2(dataset):
+    instances = dataset.load_instances()
+    for i in instances:
+        render.add_render_info(i)
+    return (
+        lambda: build_detail_pages_ec2(instances, "www/index.html"),
+        len(instances),
+    )
+
+
+BENCHMARKS = {
+    "ec2.add_pricing": bench_add_pricing,
+    "ec2.add_spot_pricing": bench_add_spot_pricing,
+    "rds.scrape": bench_rds_scrape,
+    "cache.scrape": bench_cache_scrape,
+    "render.compress_pricing": bench_compress_pricing,
+    "render.render": bench_render,
+    "detail_pages_ec2.build_detail_pages_ec2": bench_detail_pages_ec2,
+}
+
+
+def peak_rss_mb():
+    """Peak resident set size of the current process in MiB"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak / (1024 * 1024 if sys.platform == "darwin" else 1024)
+
+
+def run_benchmark(name, dataset):
+    """Run a single benchmark, meant to be called in a process of its own"""
+    os.chdir(dataset.workdir)
+    os.makedirs("out", exist_ok=True)
+    # The code under test is chatty, keep the benchmark output readable
+    with open(os.devnull, "w") as devnull, redirect_stdout(devnull):
+        run, items = BENCHMARKS[name](dataset)
+        setup_rss = peak_rss_mb()
+        start = time.perf_counter()
+        run()
+        seconds = time.perf_counter() - start
+    return {
+        "benchmark": name,
+        "scale": dataset.scale,
+        "instance_types": {k: len(v) for k, v in dataset.instance_types.items()},
+        "regions": len(dataset.regions),
+        "items": items,
+        "seconds": round(seconds, 4),
+        "items_per_second": round(items / seconds, 1) if seconds else None,
+        "setup_peak_rss_mb": round(setup_rss, 1),
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+    }
+
+
+def run_benchmarks(names, scales, workdir):
+    results = []
+    # spawn, so no benchmark inherits the memory of the ones before it
+    context = multiprocessing.get_context("spawn")
+    for scale in scales:
+        dataset = Dataset(os.path.join(workdir, "scale-%s" % scale), scale)
+        print("Generating data at %sx..." % scale)
+        start = time.perf_counter()
+        dataset.generate()
+        print("Generated data in %.1fs" % (time.perf_counter() - start))
+        for name in names:
+            print("Running %s at %sx..." % (name, scale))
+            with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+                result = executor.submit(run_benchmark, name, dataset).result()
+            print(
+                "  %.2fs, %s items/s, peak %.0f MiB"
+                % (result["seconds"], result["items_per_second"], result["peak_rss_mb"])
+            )
+            results.append(result)
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """Print the change against a baseline run and return the regressions"""
+    previous = {(r["benchmark"], r["scale"]): r for r in baseline["results"]}
+    regressions = []
+    for result in results:
+        before = previous.get((result["benchmark"], result["scale"]))
+        if before is None:
+            continue
+        change = result["seconds"] / before["seconds"] - 1 if before["seconds"] else 0
+        print(
+            "%-42s %5sx %8.2fs -> %8.2fs (%+.0f%%)"
+            % (
+                result["benchmark"],
+                result["scale"],
+                before["seconds"],
+                result["seconds"],
+                change * 100,
+            )
+        )
+        if change > tolerance:
+            regressions.append(result)
+    return regressions
+
+
+def git_commit():
+    try:
+        return (
+            subprocess.check_output(
+                ["git", "rev-parse", "HEAD"], cwd=ROOT, stderr=subprocess.DEVNULL
+            )
+            .decode()
+            .strip()
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Benchmark the scrape, pricing and render hot paths"
+    )
+    parser.add_argument(
+        "--scales",
+        default=DEFAULT_SCALES,
+        help="comma separated multiples of today's data size (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--benchmarks",
+        default=",".join(BENCHMARKS),
+        help="comma separated benchmarks to run (default: all)",
+    )
+    parser.add_argument("--output", default=DEFAULT_OUTPUT)
+    parser.add_argument("--baseline", help="results of an earlier run to compare to")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE)
+    parser.add_argument("--workdir", help="keep the generated data in this directory")
+    args = parser.parse_args(argv)
+
+    names = args.benchmarks.split(",")
+    for name in names:
+        if name not in BENCHMARKS:
+            parser.error("unknown benchmark %s" % name)
+    scales = [float(s) if "." in s else int(s) for s in args.scales.split(",")]
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix="benchmark-")
+    try:
+        results = run_benchmarks(names, scales, os.path.abspath(workdir))
+    finally:
+        if not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {
+        "generated_at": datetime.datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S UTC"),
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "results": results,
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=1)
+    print("Wrote results to %s" % args.output)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        if regressions:
+            print(
+                "ERROR: %d benchmark(s) slower than the baseline by more than %d%%"
+                % (len(regressions), args.tolerance * 100)
+            )
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
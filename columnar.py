@@ -0,0 +1,118 @@
+# Columnar binary encoding of the prices looked up by default.js.
+#
+# compress_pricing() in render.py keeps the nested pricing dicts and only
+# replaces their keys with integers. Here the prices are laid out as a dense
+# array per region instead, with one row per instance type and one column per
+# price path below the region, e.g. "linux|reserved|yrTerm1Standard.noUpfront".
+# A page embeds the small header (instance, region and column names and where
+# the arrays are stored) and fetches the arrays as binary files, so looking up
+# a price in the browser is plain array indexing.
+#
+# Prices are stored as little endian uint32 fixed point numbers when that is
+# exact (EC2 prices have at most 6 decimals, see prices.format_price) and as
+# float64 otherwise, so the browser always sees the same number as before.
+from array import array
+import hashlib
+import math
+import os
+import sys
+
+FORMAT_VERSION = 1
+SCALE = 10**6
+# Marks a missing price in uint32 arrays, float64 arrays use NaN
+MISSING = 2**32 - 1
+
+
+def _leaves(d, path=()):
+    for k, v in d.items():
+        if isinstance(v, dict):
+            yield from _leaves(v, path + (k,))
+        else:
+            yield path + (k,), v
+
+
+def _price(value):
+    # Anything that is not a single price, like a list of spot prices, is not
+    # looked up by the pages and left out
+    if isinstance(value, (list, bool)) or value is None:
+        return None
+    # A number 0 means there is no price, a price of 0 is the string "0"
+    if value == 0 and not isinstance(value, str):
+        return None
+    try:
+        price = float(value)
+    except ValueError:
+        return None
+    return price if math.isfinite(price) else None
+
+
+class ColumnarPricing(object):
+    """The prices of a list of instances, laid out per region.
+
+    Build with the instance records, then get the array of a region with
+    region_array() and the header describing them with header().
+    """
+
+    def __init__(self, instances):
+        self.instances = [i["instance_type"] for i in instances]
+        columns = {}
+        # region -> [(row, column, price), ...]
+        self.cells = {}
+        for row, i in enumerate(instances):
+            for region, region_pricing in i["pricing"].items():
+                cells = self.cells.setdefault(region, [])
+                for path, value in _leaves(region_pricing):
+                    price = _price(value)
+                    if price is None:
+                        continue
+                    column = columns.setdefault("|".join(path), len(columns))
+                    cells.append((row, column, price))
+        self.columns = list(columns)
+        self.regions = sorted(self.cells)
+        self.fixed_point = all(
+            0 <= price * SCALE < MISSING and round(price * SCALE) / SCALE == price
+            for cells in self.cells.values()
+            for _, _, price in cells
+        )
+
+    def region_array(self, region):
+        """The prices of region, as a flat array of instances x columns"""
+        width = len(self.columns)
+        if self.fixed_point:
+            values = array("I", [MISSING]) * (len(self.instances) * width)
+            for row, column, price in self.cells.get(region, []):
+                values[row * width + column] = round(price * SCALE)
+        else:
+            values = array("d", [math.nan]) * (len(self.instances) * width)
+            for row, column, price in self.cells.get(region, []):
+                values[row * width + column] = price
+        if sys.byteorder != "little":
+            values.byteswap()
+        return values
+
+    def write(self, path, regions):
+        """Write the arrays of regions, one after the other, to path.
+
+        Returns the header entry of the file.
+        """
+        data = b"".join(self.region_array(region).tobytes() for region in regions)
+        with open(path, "wb") as f:
+            f.write(data)
+        return {
+            "file": os.path.basename(path),
+            "hash": hashlib.sha256(data).hexdigest()[:16],
+            "bytes": len(data),
+            "regions": list(regions),
+        }
+
+    def header(self, base, files):
+        """What a page needs to fetch and index the arrays in files"""
+        return {
+            "version": FORMAT_VERSION,
+            "base": base,
+            "type": "uint32" if self.fixed_point else "float64",
+            "scale": SCALE if self.fixed_point else 1,
+            "instances": self.instances,
+            "columns": self.columns,
+            "files": files,
+        }
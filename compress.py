@@ -0,0 +1,184 @@
+# Precompressed gzip and brotli variants of the files served from www/.
+#
+# After rendering, every compressible file under www/ gets a .gz sibling, and a
+# .br sibling when the brotli module is installed, written by a pool of worker
+# processes. A manifest records the hash of every compressed source, so files
+# that did not change since the last run are not compressed again. deploy and
+# serve send a variant in place of the file as long as it is not older than
+# the file itself.
+import gzip
+import hashlib
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+import detail_pages
+
+# Text files, plus the binary pricing arrays which compress just as well
+COMPRESS_EXTENSIONS = (
+    ".html",
+    ".json",
+    ".js",
+    ".css",
+    ".map",
+    ".svg",
+    ".xml",
+    ".txt",
+    ".bin",
+)
+# Not worth the extra request headers and files below this size
+MIN_SIZE = 1024
+# Starts with a dot, so it is not deployed along with the files
+MANIFEST_FILE = ".compress-manifest.json"
+MANIFEST_VERSION = 2
+
+# Content-Encoding -> suffix of the variant, in order of preference
+ENCODINGS = {"br": ".br", "gzip": ".gz"}
+
+
+def _encoders():
+    encoders = {".gz": lambda data: gzip.compress(data, compresslevel=9, mtime=0)}
+    if brotli is not None:
+        encoders[".br"] = lambda data: brotli.compress(data, quality=11)
+    return encoders
+
+
+def compressible(path):
+    name = os.path.basename(path)
+    return name.endswith(COMPRESS_EXTENSIONS) and not name.startswith(".")
+
+
+def variant(path, suffix):
+    """The path of the suffix variant of path, if there is an up to date one"""
+    variant_path = path + suffix
+    try:
+        if os.path.getmtime(variant_path) >= os.path.getmtime(path):
+            return variant_path
+    except OSError:
+        pass
+    return None
+
+
+def accepted_encodings(accept_encoding):
+    """The encodings listed in an Accept-Encoding header, less those with q=0"""
+    encodings = set()
+    for part in (accept_encoding or "").split(","):
+        encoding, _, params = part.partition(";")
+        q = params.replace(" ", "").partition("q=")[2]
+        try:
+            if q and float(q) == 0:
+                continue
+        except ValueError:
+            pass
+        encodings.add(encoding.strip().lower())
+    return encodings
+
+
+def negotiate(path, accept_encoding):
+    """The file to send for path to a client, and its Content-Encoding or None"""
+    encodings = accepted_encodings(accept_encoding)
+    for encoding, suffix in ENCODINGS.items():
+        if encoding in encodings:
+            variant_path = variant(path, suffix)
+            if variant_path:
+                return variant_path, encoding
+    return path, None
+
+
+def _compress_file(path, known_key):
+    """Write the variants of path, unless they were written for its contents.
+
+    Returns the manifest key of path and the number of variants written. The
+    key is made of a hash of the contents, the encoders used and the suffixes
+    of the variants that were written, those that were not smaller than the
+    file are left out. A variant missing from that list is written again.
+    """
+    with open(path, "rb") as f:
+        data = f.read()
+    encoders = _encoders()
+    # Also changes when brotli gets installed
+    digest = hashlib.sha256(data).hexdigest() + ":" + "".join(sorted(encoders))
+    if known_key:
+        known_digest, _, known_written = known_key.rpartition(":")
+        if known_digest == digest and all(
+            variant(path, suffix) for suffix in encoders if suffix in known_written
+        ):
+            return known_key, 0
+
+    written = []
+    for suffix, encode in encoders.items():
+        compressed = encode(data) if len(data) >= MIN_SIZE else None
+        if compressed is None or len(compressed) >= len(data):
+            # Serve the file itself, without a stale variant getting in the way
+            if os.path.exists(path + suffix):
+                os.remove(path + suffix)
+            continue
+        with open(path + suffix, "wb") as f:
+            f.write(compressed)
+        written.append(suffix)
+    return digest + ":" + "".join(sorted(written)), len(written)
+
+
+def _compress_files(work):
+    return [_compress_file(path, known_key) for path, known_key in work]
+
+
+def _load_manifest(manifest_file):
+    try:
+        with open(manifest_file, "r") as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    if manifest.get("version") != MANIFEST_VERSION:
+        return {}
+    return manifest["files"]
+
+
+def compress_tree(root_dir="www", workers=None, full_rebuild=None):
+    """Write the compressed variants of all compressible files in root_dir.
+
+    Files recorded as compressed in the manifest are skipped, unless
+    full_rebuild (RENDER_FULL_REBUILD by default) is set.
+    """
+    if full_rebuild is None:
+        full_rebuild = detail_pages.RENDER_FULL_REBUILD
+    manifest_file = os.path.join(root_dir, MANIFEST_FILE)
+    manifest = {} if full_rebuild else _load_manifest(manifest_file)
+
+    paths = []
+    for root, dirs, files in os.walk(root_dir):
+        dirs[:] = [d for d in dirs if not d.startswith(".")]
+        for name in files:
+            path = os.path.join(root, name)
+            if compressible(path):
+                paths.append(path)
+    paths.sort()
+    work = [(path, manifest.get(path)) for path in paths]
+
+    workers = min(workers or detail_pages.RENDER_WORKERS, len(paths)) or 1
+    print("Compressing %d files with %d worker(s)..." % (len(paths), workers))
+    if workers == 1:
+        results = _compress_files(work)
+    else:
+        chunk_size = -(-len(work) // (workers * detail_pages.CHUNKS_PER_WORKER))
+        chunks = [work[i : i + chunk_size] for i in range(0, len(work), chunk_size)]
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = [
+                r for chunk in executor.map(_compress_files, chunks) for r in chunk
+            ]
+
+    keys = {}
+    written = 0
+    for path, (key, path_written) in zip(paths, results):
+        keys[path] = key
+        written += path_written
+    if brotli is None:
+        print("brotli is not installed, only writing gzip variants")
+    print("Wrote %d compressed variants" % written)
+    with open(manifest_file, "w") as f:
+        json.dump({"version": MANIFEST_VERSION, "files": keys}, f, indent=1)
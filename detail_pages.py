@@ -0,0 +1,323 @@
+# Rendering of the per instance type detail pages, shared by the EC2 and RDS
+# detail page builders.
+#
+# The pages are rendered by a pool of worker processes. Every worker compiles
+# the template once, then renders chunks of pages and writes each chunk out
+# in one go. Render errors are collected and handed back to the caller.
+#
+# A manifest next to the pages records a hash of the inputs of every page: the
+# template and all arguments it is rendered with, which cover the instance, its
+# family, the community links and the region list. Pages whose inputs did not
+# change since the last run are not rendered or written again, so their mtime
+# is left alone. Set RENDER_FULL_REBUILD=1 to render every page regardless,
+# e.g. after changing the code that prepares the template arguments.
+import collections
+import hashlib
+import io
+import json
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+
+import mako.exceptions
+import yaml
+
+import templates
+
+# Number of processes rendering detail pages, 1 renders in the calling process
+RENDER_WORKERS = int(os.getenv("RENDER_WORKERS", "0")) or os.cpu_count() or 1
+RENDER_FULL_REBUILD = os.getenv("RENDER_FULL_REBUILD", "0") == "1"
+
+# Chunks handed out per worker, more than one evens out uneven chunks
+CHUNKS_PER_WORKER = 4
+
+# Starts with a dot, so it is not deployed along with the pages
+MANIFEST_FILE = ".render-manifest.json"
+# Bump to invalidate existing manifests when the page hash changes meaning
+MANIFEST_VERSION = 1
+
+# State of the current worker process, set up by _init_worker()
+_worker = {}
+
+
+def _file_hash(path):
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def page_hash(template_version, args):
+    """Hash of everything that goes into a page"""
+    h = hashlib.sha256(template_version.encode("utf-8"))
+    h.update(json.dumps(args, sort_keys=True, default=str).encode("utf-8"))
+    return h.hexdigest()
+
+
+def load_manifest(manifest_file):
+    """The page hashes of the last run, by path"""
+    try:
+        with open(manifest_file, "r") as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    if manifest.get("version") != MANIFEST_VERSION:
+        return {}
+    return manifest["pages"]
+
+
+def write_manifest(manifest_file, pages):
+    with open(manifest_file, "w") as f:
+        json.dump({"version": MANIFEST_VERSION, "pages": pages}, f, indent=1)
+
+
+class Attribute(object):
+    """How an instance attribute is displayed, a row of
+    meta/service_attributes_*.csv.
+
+    Attributes are shared by all pages and never change, the displayed value of
+    an attribute on a page is an AttributeRow made by row().
+    """
+
+    __slots__ = (
+        "cloud_key",
+        "display_name",
+        "category",
+        "order",
+        "style",
+        "regex",
+        "variant_family",
+    )
+
+    def __init__(self, cloud_key, display_name, category, order, style, regex):
+        set_slot = super().__setattr__
+        set_slot("cloud_key", cloud_key)
+        set_slot("display_name", display_name)
+        set_slot("category", category)
+        set_slot("order", int(order))
+        set_slot("style", style)
+        set_slot("regex", re.compile(regex) if regex else None)
+        set_slot("variant_family", display_name[0:2])
+
+    def __setattr__(self, name, value):
+        raise AttributeError("Attribute is immutable")
+
+    def __reduce__(self):
+        """Pickled as its constructor arguments, so that it can be passed to
+        the worker processes of render_pages() with any start method:
+
+        >>> import pickle
+        >>> a = Attribute("memory", "Memory", "Compute", "2", "", "[0-9.]+")
+        >>> b = pickle.loads(pickle.dumps(a))
+        >>> b.order, b.variant_family, b.parse("16 GiB")
+        (2, 'Me', '16')
+        """
+        regex = self.regex.pattern if self.regex else ""
+        args = (self.cloud_key, self.display_name, self.category, self.order)
+        return Attribute, args + (self.style, regex)
+
+    def parse(self, value):
+        """The part of value matched by the regex of the attribute, if any"""
+        if self.regex:
+            match = self.regex.search(str(value))
+            if match:
+                return match.group()
+        return value
+
+    def row(self, value, style):
+        return AttributeRow(
+            self.cloud_key, self.display_name, self.category, self.order, value, style
+        )
+
+
+class AttributeRow(
+    collections.namedtuple(
+        "AttributeRow", "cloud_key display_name category order value style"
+    )
+):
+    """An attribute of an instance as displayed, also indexable by field name
+    like row["value"] for the templates"""
+
+    __slots__ = ()
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            return getattr(self, key)
+        return super().__getitem__(key)
+
+
+def load_regions(data_file="meta/regions_aws.yaml"):
+    """The names of the regions of the site, by region code"""
+    with open(data_file, "r") as f:
+        return yaml.safe_load(f)
+
+
+def community_links(data_file="community_contributions.yaml"):
+    """The community links of every instance type, by instance type"""
+    links = {}
+    with open(data_file, "r") as f:
+        for doc in yaml.load_all(f, Loader=yaml.SafeLoader):
+            instance_type, linklist = next(iter(doc.items()))
+            # The first document of an instance type wins
+            links.setdefault(instance_type, linklist["links"])
+    return links
+
+
+class Availability(object):
+    """Where instances are not available, from the regions and OSes they have
+    prices for.
+
+    oses is a list of (pricing key, name) pairs. The deny list rows of every
+    region and OS are built once, and the OSes an instance has prices for in a
+    region are matched as a bitmap, so fully available regions cost one
+    comparison.
+    """
+
+    def __init__(self, regions, oses):
+        self.bits = {}
+        for key, _ in oses:
+            self.bits.setdefault(key, 1 << len(self.bits))
+        self.all = (1 << len(self.bits)) - 1
+        self.regions = [
+            (
+                region,
+                [name, region, "All", "*"],
+                [(self.bits[key], [name, region, label, key]) for key, label in oses],
+            )
+            for region, name in regions.items()
+        ]
+
+    def denylist(self, pricing):
+        """[region name, region, OS name, OS] of everything without a price"""
+        denylist = []
+        for region, all_row, os_rows in self.regions:
+            region_pricing = pricing.get(region)
+            if region_pricing is None:
+                denylist.append(all_row)
+                continue
+            mask = 0
+            for key in region_pricing:
+                mask |= self.bits.get(key, 0)
+            if mask != self.all:
+                denylist.extend(row for bit, row in os_rows if not mask & bit)
+        return denylist
+
+
+def _state(template_file, page_args, shared, pages, manifest):
+    return {
+        "template_file": template_file,
+        "template_version": _file_hash(template_file),
+        "page_args": page_args,
+        "shared": shared,
+        "pages": pages,
+        "manifest": manifest,
+    }
+
+
+def _init_worker(*args):
+    _worker.update(_state(*args))
+
+
+def _template(state):
+    # Loaded on first use, a run without changes does not need it at all
+    if "template" not in state:
+        state["template"] = templates.get_template(state["template_file"])
+    return state["template"]
+
+
+def _render_chunk(start, stop, state=None):
+    """Render pages[start:stop], with the state of the worker by default.
+
+    Returns the paths of the pages that exist after rendering, the hashes to
+    record for them, the render errors and the number of pages written.
+    """
+    state = _worker if state is None else state
+    page_args = state["page_args"]
+    shared = state["shared"]
+    manifest = state["manifest"]
+
+    sitemap = []
+    hashes = {}
+    rendered = []
+    errors = []
+    for path, instance in state["pages"][start:stop]:
+        args = page_args(instance, shared)
+        key = page_hash(state["template_version"], args)
+        if manifest.get(path) == key and os.path.exists(path):
+            sitemap.append(path)
+            hashes[path] = key
+            continue
+        try:
+            rendered.append((path, _template(state).render(**args)))
+        except:
+            render_err = mako.exceptions.text_error_template().render()
+            errors.append(
+                {"e": "ERROR for " + instance["instance_type"], "t": render_err}
+            )
+            continue
+        sitemap.append(path)
+        hashes[path] = key
+
+    for path, html in rendered:
+        with io.open(path, "w", encoding="utf-8") as fh:
+            fh.write(html)
+    return sitemap, hashes, errors, len(rendered)
+
+
+def render_pages(
+    template_file,
+    page_args,
+    shared,
+    pages,
+    manifest_file=None,
+    workers=None,
+    full_rebuild=None,
+):
+    """Render a detail page for every (path, instance) pair in pages.
+
+    page_args(instance, shared) returns the template arguments of the page of
+    an instance, shared holds whatever it needs besides the instance. Both are
+    passed to the worker processes once, so page_args has to be a module level
+    function.
+
+    Pages recorded as unchanged in manifest_file are skipped, unless
+    full_rebuild is set. The manifest is rewritten with the current pages.
+
+    Returns the paths of the pages, in the order of pages, and a list of
+    {"e": title, "t": traceback} dicts for the pages that failed to render.
+    """
+    full_rebuild = RENDER_FULL_REBUILD if full_rebuild is None else full_rebuild
+    manifest = {}
+    if manifest_file and not full_rebuild:
+        manifest = load_manifest(manifest_file)
+
+    workers = min(workers or RENDER_WORKERS, len(pages)) or 1
+    print("Rendering %d detail pages with %d worker(s)..." % (len(pages), workers))
+
+    args = (template_file, page_args, shared, pages, manifest)
+    if workers == 1:
+        # Not through _worker, renders of other pages may run in other threads
+        results = [_render_chunk(0, len(pages), _state(*args))]
+    else:
+        chunk_size = -(-len(pages) // (workers * CHUNKS_PER_WORKER))
+        with ProcessPoolExecutor(
+            max_workers=workers, initializer=_init_worker, initargs=args
+        ) as executor:
+            futures = [
+                executor.submit(_render_chunk, start, start + chunk_size)
+                for start in range(0, len(pages), chunk_size)
+            ]
+            results = [future.result() for future in futures]
+
+    sitemap = []
+    hashes = {}
+    errors = []
+    written = 0
+    for chunk_sitemap, chunk_hashes, chunk_errors, chunk_written in results:
+        sitemap.extend(chunk_sitemap)
+        hashes.update(chunk_hashes)
+        errors.extend(chunk_errors)
+        written += chunk_written
+    print("Wrote %d detail pages, %d unchanged" % (written, len(sitemap) - written))
+
+    if manifest_file:
+        write_manifest(manifest_file, hashes)
+    return sitemap, errors
@@ -1,14 +1,24 @@
-import mako.template
-import mako.lookup
-import mako.exceptions
-import io
-import json
-import datetime
 import os
 import csv
-import bisect
-import yaml
-import re
+
+import detail_pages
+
+# The names of the OSes, by pricing key
+EC2_OS = {
+    "linux": "Linux",
+    "mswin": "Windows",
+    "rhel": "Red Hat",
+    "sles": "SUSE",
+    "linuxSQL": "Linux SQL Server",
+    "linuxSQLWeb": "Linux SQL Server for Web",
+    "linuxSQLEnterprise": "Linux SQL Enterprise",
+    "mswinSQL": "Windows SQL Server",
+    "mswinSQLWeb": "Windows SQL Web",
+    "mswinSQLEnterprise": "Windows SQL Enterprise",
+    "rhelSQL": "Red Hat SQL Server",
+    "rhelSQLWeb": "Red Hat SQL Web",
+    "rhelSQLEnterprise": "Red Hat SQL Enterprise",
+}
 
 
 def storage(sattrs, imap):
@@ -17,12 +27,11 @@ def storage(sattrs, imap):
     storage_details = []
     for s, v in sattrs.items():
         try:
-            display = imap[s]
-            display["value"] = v
-            storage_details.append(format_attribute(display))
+            attribute = imap[s]
         except KeyError:
             # We chose not to represent this storage attribute
             continue
+        storage_details.append(format_attribute(attribute, v))
     return storage_details
 
 
@@ -66,52 +75,6 @@ def description(id):
     )
 
 
-def community(instance, links):
-    # TODO: not the most efficient with many links
-    for l in links:
-        k, linklist = next(iter(l.items()))
-        if k == instance:
-            return linklist["links"]
-    return []
-
-
-def unavailable_instances(itype, instance_details):
-    data_file = "meta/regions_aws.yaml"
-    ec2_os = {
-        "linux": "Linux",
-        "mswin": "Windows",
-        "rhel": "Red Hat",
-        "sles": "SUSE",
-        "linuxSQL": "Linux SQL Server",
-        "linuxSQLWeb": "Linux SQL Server for Web",
-        "linuxSQLEnterprise": "Linux SQL Enterprise",
-        "mswinSQL": "Windows SQL Server",
-        "mswinSQLWeb": "Windows SQL Web",
-        "mswinSQLEnterprise": "Windows SQL Enterprise",
-        "rhelSQL": "Red Hat SQL Server",
-        "rhelSQLWeb": "Red Hat SQL Web",
-        "rhelSQLEnterprise": "Red Hat SQL Enterprise",
-    }
-
-    denylist = []
-    with open(data_file, "r") as f:
-        aws_regions = yaml.safe_load(f)
-        instance_regions = instance_details["Pricing"].keys()
-
-        # If there is no price for a region and os, then it is unavailable
-        for r in aws_regions:
-            if r not in instance_regions:
-                # print("Found that {} is not available in {}".format(itype, r))
-                denylist.append([aws_regions[r], r, "All", "*"])
-            else:
-                instance_regions_oss = instance_details["Pricing"][r].keys()
-                for os in ec2_os.keys():
-                    if os not in instance_regions_oss:
-                        denylist.append([aws_regions[r], r, ec2_os[os], os])
-                        # print("Found that {} is not available in {} as {}".format(itype, r, os))
-    return denylist
-
-
 def assemble_the_families(instances):
     # Build 2 lists - one where we can lookup what family an instance belongs to
     # and another where we can get the family and see what the members are
@@ -221,43 +184,28 @@ def load_service_attributes():
             else:
                 category = row[2]
 
-            display_map[cloud_key] = {
-                "cloud_key": cloud_key,
-                "display_name": row[1],
-                "category": category,
-                "order": row[3],
-                "style": row[4],
-                "regex": row[5],
-                "value": None,
-                "variant_family": row[1][0:2],
-            }
+            display_map[cloud_key] = detail_pages.Attribute(
+                cloud_key, row[1], category, row[3], row[4], row[5]
+            )
 
     return display_map
 
 
-def format_attribute(display):
-
-    if display["regex"]:
-        toparse = str(display["value"])
-        regex = str(display["regex"])
-        match = re.search(regex, toparse)
-        if match:
-            display["value"] = match.group()
-        # else:
-        #     print("No match found for {} with regex {}".format(toparse, regex))
-
-    if display["style"]:
-        v = str(display["value"]).lower()
+def format_attribute(attribute, value):
+    value = attribute.parse(value)
+    style = attribute.style
+    if style:
+        v = str(value).lower()
         if v == "false" or v == "0" or v == "none":
-            display["style"] = "value value-false"
+            style = "value value-false"
         elif v == "current":
-            display["style"] = "value value-current"
+            style = "value value-current"
         elif v == "previous":
-            display["style"] = "value value-previous"
+            style = "value value-previous"
         else:
-            display["style"] = "value value-true"
+            style = "value value-true"
 
-    return display
+    return attribute.row(value, style)
 
 
 def map_ec2_attributes(i, imap):
@@ -285,15 +233,14 @@ def map_ec2_attributes(i, imap):
     for j, k in i.items():
         # Some attributes like storage have nested values that we handle differently
         if j not in special_attributes:
-            display = imap[j]
-            display["value"] = k
-            instance_details[display["category"]].append(format_attribute(display))
+            attribute = imap[j]
+            instance_details[attribute.category].append(format_attribute(attribute, k))
 
     # Special cases
     instance_details["Storage"].extend(storage(i["storage"], imap))
 
     for c in categories:
-        instance_details[c].sort(key=lambda x: int(x["order"]))
+        instance_details[c].sort(key=lambda x: x.order)
 
     # Pricing widget
     instance_details["Pricing"] = prices(i["pricing"])
@@ -302,12 +249,27 @@ def map_ec2_attributes(i, imap):
     return instance_details
 
 
-def build_detail_pages_ec2(instances, destination_file):
+def page_args(i, shared):
+    """The template arguments of the detail page of instance i"""
+    instance_type = i["instance_type"]
+    instance_details = map_ec2_attributes(i, shared["imap"])
+    fam = shared["fam_lookup"][instance_type]
+    return dict(
+        i=instance_details,
+        family=shared["ifam"][fam],
+        description=description(instance_details),
+        links=shared["links"].get(instance_type, []),
+        unavailable=shared["availability"].denylist(instance_details["Pricing"]),
+        defaults=initial_prices(instance_details),
+        variants=shared["variants"][instance_type[0:2]],
+    )
+
+
+def build_detail_pages_ec2(
+    instances, destination_file, workers=None, full_rebuild=None
+):
     # Extract which service these instances belong to, for example EC2 is loaded at /
     service_path = destination_file.split("/")[1]
-    data_file = "community_contributions.yaml"
-    stream = open(data_file, "r")
-    community_data = list(yaml.load_all(stream, Loader=yaml.SafeLoader))
 
     # Find the right path to write these files to. There is a .gitignore file
     # in each directory so that these generated files are not committed
@@ -317,48 +279,30 @@ def build_detail_pages_ec2(instances, destination_file):
 
     ifam, fam_lookup, variants = assemble_the_families(instances)
     imap = load_service_attributes()
+    # Loaded once for all pages
+    shared = {
+        "links": detail_pages.community_links(),
+        "availability": detail_pages.Availability(
+            detail_pages.load_regions(), EC2_OS.items()
+        ),
+        "ifam": ifam,
+        "fam_lookup": fam_lookup,
+        "variants": variants,
+        "imap": imap,
+    }
 
-    lookup = mako.lookup.TemplateLookup(directories=["."])
-    template = mako.template.Template(
-        filename="in/instance-type.html.mako", lookup=lookup
+    # To add more data to a single instance page, do so in page_args()
+    pages = [(os.path.join(subdir, i["instance_type"] + ".html"), i) for i in instances]
+    sitemap, could_not_render = detail_pages.render_pages(
+        "in/instance-type.html.mako",
+        page_args,
+        shared,
+        pages,
+        manifest_file=os.path.join(subdir, detail_pages.MANIFEST_FILE),
+        workers=workers,
+        full_rebuild=full_rebuild,
     )
 
-    # To add more data to a single instance page, do so inside this loop
-    could_not_render = []
-    sitemap = []
-    for i in instances:
-        instance_type = i["instance_type"]
-
-        instance_page = os.path.join(subdir, instance_type + ".html")
-        instance_details = map_ec2_attributes(i, imap)
-        fam = fam_lookup[instance_type]
-        fam_members = ifam[fam]
-        idescription = description(instance_details)
-        links = community(instance_type, community_data)
-        denylist = unavailable_instances(instance_type, instance_details)
-        defaults = initial_prices(instance_details)
-
-        print("Rendering %s to detail page %s..." % (instance_type, instance_page))
-        with io.open(instance_page, "w+", encoding="utf-8") as fh:
-            try:
-                fh.write(
-                    template.render(
-                        i=instance_details,
-                        family=fam_members,
-                        description=idescription,
-                        links=links,
-                        unavailable=denylist,
-                        defaults=defaults,
-                        variants=variants[instance_type[0:2]],
-                    )
-                )
-                sitemap.append(instance_page)
-            except:
-                render_err = mako.exceptions.text_error_template().render()
-                err = {"e": "ERROR for " + instance_type, "t": render_err}
-
-                could_not_render.append(err)
-
     [print(err["e"], "{}".format(err["t"])) for err in could_not_render]
     [print(page["e"]) for page in could_not_render]
 
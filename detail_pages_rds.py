@@ -1,15 +1,7 @@
-import mako.template
-import mako.lookup
-import mako.exceptions
-import io
-import json
-import datetime
 import os
 import csv
-import bisect
-import yaml
-import re
 
+import detail_pages
 
 rds_engine_mapping = {
     "2": "MySQL",
@@ -89,37 +81,6 @@ def description(id):
     )
 
 
-def community(instance, links):
-    # TODO: not the most efficient with many links
-    for l in links:
-        k, linklist = next(iter(l.items()))
-        if k == instance:
-            return linklist["links"]
-    return []
-
-
-def unavailable_instances(itype, instance_details):
-    data_file = "meta/regions_aws.yaml"
-
-    denylist = []
-    with open(data_file, "r") as f:
-        aws_regions = yaml.safe_load(f)
-        instance_regions = instance_details["Pricing"].keys()
-
-        # If there is no price for a region and os, then it is unavailable
-        for r in aws_regions:
-            if r not in instance_regions:
-                # print("Found that {} is not available in {}".format(itype, r))
-                denylist.append([aws_regions[r], r, "All", "*"])
-            else:
-                instance_regions_oss = instance_details["Pricing"][r].keys()
-                for os in rds_engine_mapping.values():
-                    if os not in instance_regions_oss:
-                        denylist.append([aws_regions[r], r, os, os])
-                        # print("Found that {} is not available in {} as {}".format(itype, r, os))
-    return denylist
-
-
 def assemble_the_families(instances):
     # Build 2 lists - one where we can lookup what family an instance belongs to
     # and another where we can get the family and see what the members are
@@ -228,16 +189,9 @@ def load_service_attributes():
             else:
                 category = row[2]
 
-            display_map[cloud_key] = {
-                "cloud_key": cloud_key,
-                "display_name": row[1],
-                "category": category,
-                "order": row[3],
-                "style": row[4],
-                "regex": row[5],
-                "value": None,
-                "variant_family": row[1][0:2],
-            }
+            display_map[cloud_key] = detail_pages.Attribute(
+                cloud_key, row[1], category, row[3], row[4], row[5]
+            )
 
     return display_map
 
@@ -260,50 +214,57 @@ def map_rds_attributes(i, imap):
     # For up to date display names, inspect meta/service_attributes_ec2.csv
     for j, k in i.items():
 
-        display = imap[j]
-        display["value"] = k if j != "pricing" else {}
-
-        if display["regex"]:
-            toparse = str(display["value"])
-            regex = str(display["regex"])
-            match = re.search(regex, toparse)
-            if match:
-                display["value"] = match.group()
-            # else:
-            #     print("No match found for {} with regex {}".format(toparse, regex))
+        attribute = imap[j]
+        value = attribute.parse(k if j != "pricing" else {})
+        style = attribute.style
 
-        if display["style"]:
-            v = str(display["value"]).lower()
+        if style:
+            v = str(value).lower()
             # print(v)  # print styling value
-            if display["cloud_key"] == "currentGeneration" and v == "yes":
-                display["style"] = "value value-current"
-                display["value"] = "current"
+            if attribute.cloud_key == "currentGeneration" and v == "yes":
+                style = "value value-current"
+                value = "current"
             elif v == "false" or v == "0" or v == "none":
-                display["style"] = "value value-false"
+                style = "value value-false"
             elif v == "true" or v == "1" or v == "yes":
-                display["style"] = "value value-true"
-            elif display["cloud_key"] == "currentGeneration" and v == "no":
-                display["style"] = "value value-previous"
-                display["value"] = "previous"
+                style = "value value-true"
+            elif attribute.cloud_key == "currentGeneration" and v == "no":
+                style = "value value-previous"
+                value = "previous"
 
-        instance_details[display["category"]].append(display)
+        instance_details[attribute.category].append(attribute.row(value, style))
 
     # Sort the instance attributes in each category alphabetically,
     # another general-purpose option could be to sort by value data type
     for c in categories:
-        instance_details[c].sort(key=lambda x: int(x["order"]))
+        instance_details[c].sort(key=lambda x: x.order)
 
     instance_details["Pricing"] = prices(i["pricing"])
     # print(json.dumps(instance_details, indent=4))
     return instance_details
 
 
-def build_detail_pages_rds(instances, destination_file):
+def page_args(i, shared):
+    """The template arguments of the detail page of instance i"""
+    instance_type = i["instance_type"]
+    instance_details = map_rds_attributes(i, shared["imap"])
+    fam = shared["fam_lookup"][instance_type]
+    return dict(
+        i=instance_details,
+        family=shared["ifam"][fam],
+        description=description(instance_details),
+        links=shared["links"].get(instance_type, []),
+        unavailable=shared["availability"].denylist(instance_details["Pricing"]),
+        defaults=initial_prices(instance_details, instance_type),
+        variants=shared["variants"][instance_type[3:5]],
+    )
+
+
+def build_detail_pages_rds(
+    instances, destination_file, workers=None, full_rebuild=None
+):
     # Extract which service these instances belong to, for example EC2 is loaded at /
     service_path = destination_file.split("/")[1]
-    data_file = "community_contributions.yaml"
-    stream = open(data_file, "r")
-    community_data = list(yaml.load_all(stream, Loader=yaml.SafeLoader))
 
     # Find the right path to write these files to. There is a .gitignore file
     # in each directory so that these generated files are not committed
@@ -313,49 +274,31 @@ def build_detail_pages_rds(instances, destination_file):
 
     ifam, fam_lookup, variants = assemble_the_families(instances)
     imap = load_service_attributes()
-
-    lookup = mako.lookup.TemplateLookup(directories=["."])
-    template = mako.template.Template(
-        filename="in/instance-type-rds.html.mako", lookup=lookup
+    # Loaded once for all pages
+    shared = {
+        "links": detail_pages.community_links(),
+        "availability": detail_pages.Availability(
+            detail_pages.load_regions(),
+            [(os, os) for os in rds_engine_mapping.values()],
+        ),
+        "ifam": ifam,
+        "fam_lookup": fam_lookup,
+        "variants": variants,
+        "imap": imap,
+    }
+
+    # To add more data to a single instance page, do so in page_args()
+    pages = [(os.path.join(subdir, i["instance_type"] + ".html"), i) for i in instances]
+    sitemap, could_not_render = detail_pages.render_pages(
+        "in/instance-type-rds.html.mako",
+        page_args,
+        shared,
+        pages,
+        manifest_file=os.path.join(subdir, detail_pages.MANIFEST_FILE),
+        workers=workers,
+        full_rebuild=full_rebuild,
     )
 
-    # To add more data to a single instance page, do so inside this loop
-    could_not_render = []
-    sitemap = []
-    for i in instances:
-        instance_type = i["instance_type"]
-
-        instance_page = os.path.join(subdir, instance_type + ".html")
-        instance_details = map_rds_attributes(i, imap)
-        fam = fam_lookup[instance_type]
-        fam_members = ifam[fam]
-        idescription = description(instance_details)
-        links = community(instance_type, community_data)
-        denylist = unavailable_instances(instance_type, instance_details)
-        defaults = initial_prices(instance_details, instance_type)
-
-        print("Rendering %s to detail page %s..." % (instance_type, instance_page))
-        with io.open(instance_page, "w+", encoding="utf-8") as fh:
-            try:
-                fh.write(
-                    template.render(
-                        i=instance_details,
-                        family=fam_members,
-                        description=idescription,
-                        links=links,
-                        unavailable=denylist,
-                        defaults=defaults,
-                        variants=variants[instance_type[3:5]],
-                    )
-                )
-                sitemap.append(instance_page)
-            except:
-                render_err = mako.exceptions.text_error_template().render()
-                err = {"e": "ERROR for " + instance_type, "t": render_err}
-
-                could_not_render.append(err)
-        # break
-
     [print(err["e"], "{}".format(err["t"])) for err in could_not_render]
     [print(page["e"]) for page in could_not_render]
 
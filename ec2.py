@@ -1,14 +1,40 @@
 import botocore
 import botocore.exceptions
 import boto3
+import collections
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+import fixtures
 import locale
 import json
+import os
 from pkg_resources import resource_filename
+import prices
 import re
 import scrape
 import traceback
 
+# Number of regions queried at the same time by the per-region EC2 API fan-outs
+REGION_WORKERS = int(os.getenv("REGION_WORKERS", "16"))
+
+# Keep the full list of spot prices next to spot_min/spot_max. The site only
+# uses the aggregates, and the list accounts for a good part of instances.json
+KEEP_SPOT_HISTORY = os.getenv("KEEP_SPOT_HISTORY", "1") != "0"
+
+
+def client(service_name, region_name):
+    """Create a boto3 client that is safe to use from a worker thread.
+
+    boto3.client() goes through the shared default session, which is not
+    thread safe, so every client gets a session of its own. In fixture record
+    or replay mode the client is instrumented accordingly, see fixtures.py.
+    """
+    c = boto3.session.Session().client(service_name, region_name=region_name)
+    bundle = fixtures.active()
+    if bundle is not None:
+        bundle.instrument(c)
+    return c
+
 
 def canonicalize_location(location):
     """Ensure location aligns with one of the options returned by get_region_descriptions()"""
@@ -75,7 +101,7 @@ def get_region_descriptions():
 def get_instances():
     instance_types = {}
     try:
-        ec2_client = boto3.client("ec2", region_name="us-east-1")
+        ec2_client = client("ec2", region_name="us-east-1")
         ec2_pager = ec2_client.get_paginator("describe_instance_types")
         instance_type_iterator = ec2_pager.paginate()
         for result in instance_type_iterator:
@@ -88,7 +114,7 @@ def get_instances():
         raise e
 
     instances = {}
-    pricing_client = boto3.client("pricing", region_name="us-east-1")
+    pricing_client = client("pricing", region_name="us-east-1")
     product_pager = pricing_client.get_paginator("get_products")
 
     product_iterator = product_pager.paginate(
@@ -137,70 +163,120 @@ def get_instances():
     return list(instances.values())
 
 
-def add_pricing(imap):
-    descriptions = get_region_descriptions()
-    pricing_client = boto3.client("pricing", region_name="us-east-1")
+# Filters of the EC2 products add_pricing() is interested in
+PRICING_FILTERS = [
+    {"Type": "TERM_MATCH", "Field": "capacityStatus", "Value": "Used"},
+    {"Type": "TERM_MATCH", "Field": "tenancy", "Value": "Shared"},
+    {
+        "Type": "TERM_MATCH",
+        "Field": "licenseModel",
+        "Value": "No License required",
+    },
+]
+
+
+def get_pricing_locations():
+    """All values of the location attribute of the AmazonEC2 products"""
+    pricing_client = client("pricing", region_name="us-east-1")
+    attribute_pager = pricing_client.get_paginator("get_attribute_values")
+    locations = []
+    for page in attribute_pager.paginate(
+        ServiceCode="AmazonEC2", AttributeName="location"
+    ):
+        locations.extend(value["Value"] for value in page["AttributeValues"])
+    return locations
+
+
+def get_location_offers(location):
+    """Fetch and decode the EC2 offers of a single pricing location"""
+    pricing_client = client("pricing", region_name="us-east-1")
     product_pager = pricing_client.get_paginator("get_products")
 
     product_iterator = product_pager.paginate(
         ServiceCode="AmazonEC2",
-        Filters=[
-            {"Type": "TERM_MATCH", "Field": "capacityStatus", "Value": "Used"},
-            {"Type": "TERM_MATCH", "Field": "tenancy", "Value": "Shared"},
-            {
-                "Type": "TERM_MATCH",
-                "Field": "licenseModel",
-                "Value": "No License required",
-            },
-        ],
+        Filters=PRICING_FILTERS
+        + [{"Type": "TERM_MATCH", "Field": "location", "Value": location}],
     )
+    offers = []
     for product_item in product_iterator:
         for offer_string in product_item.get("PriceList"):
-            offer = json.loads(offer_string)
-            product = offer.get("product")
-            product_attributes = product.get("attributes")
-            instance_type = product_attributes.get("instanceType")
-            location = canonicalize_location(product_attributes.get("location"))
+            offers.append(json.loads(offer_string))
+    return offers
 
-            # There may be a slight delay in updating botocore with new regional endpoints, skip and inform
-            if location not in descriptions:
-                print(
-                    f"WARNING: Ignoring pricing - unknown location. instance={instance_type}, location={location}"
-                )
-                continue
 
-            region = descriptions[location]
-            terms = offer.get("terms")
+def add_pricing(imap, max_workers=REGION_WORKERS):
+    """Add on demand, reserved and spot pricing to the instances in imap.
 
-            operating_system = product_attributes.get("operatingSystem")
-            preinstalled_software = product_attributes.get("preInstalledSw")
-            platform = translate_platform_name(operating_system, preinstalled_software)
+    The products are queried one location at a time, with up to max_workers
+    locations being paginated and decoded concurrently. The results are added
+    to the instances on the calling thread, in location order. A location is
+    only submitted once an earlier one has been added, so no more than
+    max_workers locations of decoded offers are held at a time.
+    """
+    descriptions = get_region_descriptions()
+    reserved_prices = prices.ReservedPrices()
+
+    def add_location_offers(future):
+        for offer in future.result():
+            add_offer_pricing(imap, descriptions, reserved_prices, offer)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        pending = collections.deque()
+        for location in get_pricing_locations():
+            if len(pending) == max_workers:
+                add_location_offers(pending.popleft())
+            pending.append(executor.submit(get_location_offers, location))
+        while pending:
+            add_location_offers(pending.popleft())
+
+    reserved_prices.apply(format_price)
+    add_spot_pricing(imap)
 
-            if instance_type not in imap:
-                print(
-                    f"WARNING: Ignoring pricing - unknown instance type. instance={instance_type}, location={location}"
-                )
-                continue
 
-            # If the instance type is not in us-east-1 imap[instance_type] could fail
-            try:
-                inst = imap[instance_type]
-                inst.pricing.setdefault(region, {})
-                inst.pricing[region].setdefault(platform, {})
-                inst.pricing[region][platform]["ondemand"] = get_ondemand_pricing(terms)
-                # Some instances don't offer reserved terms at all
-                reserved = get_reserved_pricing(terms)
-                if reserved:
-                    inst.pricing[region][platform]["reserved"] = reserved
-            except Exception as e:
-                # print more details about the instance for debugging
-                print(f"ERROR: Exception adding pricing for {instance_type}: {e}")
-                print(traceback.print_exc())
-    add_spot_pricing(imap)
+def add_offer_pricing(imap, descriptions, reserved_prices, offer):
+    product = offer.get("product")
+    product_attributes = product.get("attributes")
+    instance_type = product_attributes.get("instanceType")
+    location = canonicalize_location(product_attributes.get("location"))
 
+    # There may be a slight delay in updating botocore with new regional endpoints, skip and inform
+    if location not in descriptions:
+        print(
+            f"WARNING: Ignoring pricing - unknown location. instance={instance_type}, location={location}"
+        )
+        return
 
-def format_price(price):
-    return str(float("%f" % float(price))).rstrip("0").rstrip(".")
+    region = descriptions[location]
+    terms = offer.get("terms")
+
+    operating_system = product_attributes.get("operatingSystem")
+    preinstalled_software = product_attributes.get("preInstalledSw")
+    platform = translate_platform_name(operating_system, preinstalled_software)
+
+    if instance_type not in imap:
+        print(
+            f"WARNING: Ignoring pricing - unknown instance type. instance={instance_type}, location={location}"
+        )
+        return
+
+    # If the instance type is not in us-east-1 imap[instance_type] could fail
+    try:
+        inst = imap[instance_type]
+        inst.pricing.setdefault(region, {})
+        inst.pricing[region].setdefault(platform, {})
+        inst.pricing[region][platform]["ondemand"] = get_ondemand_pricing(terms)
+        # Some instances don't offer reserved terms at all
+        if terms.get("Reserved"):
+            inst.pricing[region][platform]["reserved"] = get_reserved_pricing(
+                terms, reserved_prices
+            )
+    except Exception as e:
+        # print more details about the instance for debugging
+        print(f"ERROR: Exception adding pricing for {instance_type}: {e}")
+        print(traceback.print_exc())
+
+
+format_price = prices.format_price
 
 
 def get_ondemand_pricing(terms):
@@ -217,7 +293,12 @@ def get_ondemand_pricing(terms):
     return format_price(price)
 
 
-def get_reserved_pricing(terms):
+def get_reserved_pricing(terms, reserved_prices):
+    """Queue the reserved terms in the reserved_prices batch.
+
+    Returns the dict the effective prices are written to by
+    reserved_prices.apply().
+    """
     pricing = {}
     reserved_terms = terms.get("Reserved", {})
     for reserved_term in reserved_terms.keys():
@@ -238,14 +319,53 @@ def get_reserved_pricing(terms):
             else:
                 upfront_price = temp_price
         local_term = translate_reserved_terms(term_attributes)
-        lease_in_years = term_attributes.get("LeaseContractLength")[0]
-        hours_in_term = int(lease_in_years[0]) * 365 * 24
-        price = float(price_per_hour) + (float(upfront_price) / hours_in_term)
-        pricing[local_term] = format_price(price)
+        lease_in_years = int(term_attributes.get("LeaseContractLength")[0])
+        reserved_prices.add(
+            pricing, local_term, upfront_price, price_per_hour, lease_in_years
+        )
     return pricing
 
 
-def add_spot_pricing(imap):
+def get_region_spot_prices(region, instance_types, keep_history=KEEP_SPOT_HISTORY):
+    """Fetch the current spot prices of a single region.
+
+    Returns a dict of (instance_type, region, platform) -> [min, max, history]
+    where every price is kept as a (float, original string) pair. The price
+    string is converted once per record and min/max are tracked as the records
+    stream in. history is None unless keep_history is set.
+    """
+    prices = {}
+    try:
+        ec2_client = client("ec2", region_name=region)
+        prices_pager = ec2_client.get_paginator("describe_spot_price_history")
+        prices_iterator = prices_pager.paginate(
+            InstanceTypes=instance_types, StartTime=datetime.now()
+        )
+        for p in prices_iterator:
+            for price in p["SpotPriceHistory"]:
+                platform = translate_platform_name(price["ProductDescription"], "NA")
+                key = (
+                    price["InstanceType"],
+                    price["AvailabilityZone"][0:-1],
+                    platform,
+                )
+                value = (float(price["SpotPrice"]), price["SpotPrice"])
+                aggregate = prices.get(key)
+                if aggregate is None:
+                    prices[key] = [value, value, [value] if keep_history else None]
+                    continue
+                if value[0] < aggregate[0][0]:
+                    aggregate[0] = value
+                if value[0] >= aggregate[1][0]:
+                    aggregate[1] = value
+                if keep_history:
+                    aggregate[2].append(value)
+    except botocore.exceptions.ClientError:
+        pass
+    return prices
+
+
+def add_spot_pricing(imap, keep_history=KEEP_SPOT_HISTORY, max_workers=REGION_WORKERS):
     instance_types = list(imap.keys())
     # get a list of all available regions across all instance types
     regions = []
@@ -253,54 +373,29 @@ def add_spot_pricing(imap):
         regions += [r for r in imap[instance_type].pricing.keys()]
     # deduplicate list of regions
     regions = list(dict.fromkeys(regions))
-    for region in regions:
-        try:
-            # get all spot price data from a region
-            ec2_client = boto3.client("ec2", region_name=region)
-            prices_pager = ec2_client.get_paginator("describe_spot_price_history")
-            prices_iterator = prices_pager.paginate(
-                InstanceTypes=instance_types, StartTime=datetime.now()
-            )
-            # populate spot prices into the instance data
-            for p in prices_iterator:
-                prices = p["SpotPriceHistory"]
-                for price in prices:
-                    inst = imap[price["InstanceType"]]
-                    platform = translate_platform_name(
-                        price["ProductDescription"], "NA"
-                    )
-                    region = price["AvailabilityZone"][0:-1]
-                    if region in inst.pricing:
-                        inst.pricing[region].setdefault(platform, {})
-                        inst.pricing[region][platform].setdefault("spot", [])
-                        inst.pricing[region][platform].setdefault("spot_min", "N/A")
-                        inst.pricing[region][platform].setdefault("spot_max", "N/A")
-                        inst.pricing[region][platform]["spot"].append(
-                            price["SpotPrice"]
-                        )
-                        inst.pricing[region][platform]["spot"].sort(key=float)
-                        inst.pricing[region][platform]["spot_min"] = inst.pricing[
-                            region
-                        ][platform]["spot"][0]
-                        inst.pricing[region][platform]["spot_max"] = inst.pricing[
-                            region
-                        ][platform]["spot"][-1]
-                    else:
-                        # In rare cases (occuring for the first time in July 2022), instances
-                        # can be available in a region as spots but not on demand or any other
-                        # way. In that case, the logic above will fail and we need to wrap it
-                        # in a conditional and create the region first to put spot prices in
-                        # If more edge cases: print(json.dumps(inst.to_dict(), indent=4))
-                        inst.pricing[region] = {
-                            platform: {
-                                "spot": [price["SpotPrice"]],
-                                "spot_min": price["SpotPrice"],
-                                "spot_max": price["SpotPrice"],
-                            }
-                        }
-
-        except botocore.exceptions.ClientError:
-            pass
+
+    # get all spot price data, one region per worker
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        region_prices = executor.map(
+            lambda region: get_region_spot_prices(region, instance_types, keep_history),
+            regions,
+        )
+        # populate spot prices into the instance data
+        for prices in region_prices:
+            for (instance_type, region, platform), aggregate in prices.items():
+                spot_min, spot_max, history = aggregate
+                # In rare cases (occuring for the first time in July 2022), instances
+                # can be available in a region as spots but not on demand or any other
+                # way, so the region may have to be created here.
+                inst = imap[instance_type]
+                spot_pricing = inst.pricing.setdefault(region, {}).setdefault(
+                    platform, {}
+                )
+                if history is not None:
+                    history.sort(key=lambda v: v[0])
+                    spot_pricing["spot"] = [v[1] for v in history]
+                spot_pricing["spot_min"] = spot_min[1]
+                spot_pricing["spot_max"] = spot_max[1]
 
 
 def parse_instance(instance_type, product_attributes, api_description):
@@ -389,7 +484,7 @@ def parse_instance(instance_type, product_attributes, api_description):
 
 
 def describe_regions():
-    ec2_client = boto3.client("ec2", region_name="us-east-1")
+    ec2_client = client("ec2", region_name="us-east-1")
     response = ec2_client.describe_regions(AllRegions=True)
     for region in response["Regions"]:
         yield region["RegionName"]
@@ -400,7 +495,7 @@ def describe_instance_type_offerings(region_name="us-east-1", location_type="reg
     location_type = 'region' | 'availability-zone' | 'availability-zone-id'
     """
     try:
-        ec2_client = boto3.client("ec2", region_name=region_name)
+        ec2_client = client("ec2", region_name=region_name)
         paginator = ec2_client.get_paginator("describe_instance_type_offerings")
         page_iterator = paginator.paginate(LocationType=location_type)
         filtered_iterator = page_iterator.search("InstanceTypeOfferings")
@@ -0,0 +1,135 @@
+# Shared HTTP fetch layer for the scrapers.
+#
+# Responses are cached on disk, keyed by URL, together with their ETag and
+# Last-Modified validators. A cached copy is revalidated with a conditional
+# request (If-None-Match / If-Modified-Since) once it is older than the TTL, so
+# unchanged documents, most notably the multi-hundred MB offer files, are not
+# downloaded again. The cache is controlled with these environment variables:
+#
+#   FETCH_CACHE_DIR  where responses are stored (default: .cache/fetch)
+#   FETCH_CACHE_TTL  seconds a cached response is used without revalidation
+#                    (default: 0, always revalidate)
+#   FETCH_OFFLINE    set to 1 to only serve from the cache, never the network
+import hashlib
+import json
+import os
+import tempfile
+import time
+
+import requests
+
+import fixtures
+
+CACHE_DIR = os.getenv("FETCH_CACHE_DIR", ".cache/fetch")
+CACHE_TTL = int(os.getenv("FETCH_CACHE_TTL", "0"))
+OFFLINE = os.getenv("FETCH_OFFLINE", "0") == "1"
+
+# Seconds to wait for the server to send data, not for the whole download
+TIMEOUT = 60
+CHUNK_SIZE = 1024 * 1024
+
+
+def cache_paths(url, cache_dir=None):
+    """Return the (body, metadata) paths a response for url is cached at"""
+    key = hashlib.sha256(url.encode("utf-8")).hexdigest()
+    base = os.path.join(cache_dir or CACHE_DIR, key)
+    return base + ".body", base + ".json"
+
+
+def _read_metadata(meta_path):
+    try:
+        with open(meta_path, "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _write_atomic(path, chunks):
+    # Write to a temporary file first so concurrent readers (and interrupted
+    # runs) never see a partially written cache entry
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            for chunk in chunks:
+                f.write(chunk)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def _write_metadata(meta_path, metadata):
+    _write_atomic(meta_path, [json.dumps(metadata, indent=1).encode("utf-8")])
+
+
+def fetch_file(url, ttl=None, offline=None, cache_dir=None):
+    """Fetch url through the on-disk cache and return the path of the body.
+
+    The body is streamed to disk, so arbitrarily large documents can be fetched
+    without holding them in memory. If the network request fails and a stale
+    copy is cached, the stale copy is used and a warning is printed.
+
+    When recording or replaying fixtures (see fixtures.py), the body is
+    recorded into, or served from, the fixture bundle.
+    """
+    bundle = fixtures.active()
+    if bundle is not None and not bundle.recording:
+        return bundle.replay_http(url)
+
+    body_path = _fetch_file(url, ttl, offline, cache_dir)
+    if bundle is not None:
+        bundle.record_http(url, body_path)
+    return body_path
+
+
+def _fetch_file(url, ttl, offline, cache_dir):
+    ttl = CACHE_TTL if ttl is None else ttl
+    offline = OFFLINE if offline is None else offline
+    body_path, meta_path = cache_paths(url, cache_dir)
+    metadata = _read_metadata(meta_path)
+    if metadata is not None and not os.path.exists(body_path):
+        metadata = None
+
+    if metadata is not None and (offline or time.time() - metadata["fetched_at"] < ttl):
+        return body_path
+    if offline:
+        raise FileNotFoundError("No cached response for %s in offline mode" % url)
+
+    headers = {}
+    if metadata is not None:
+        if metadata.get("etag"):
+            headers["If-None-Match"] = metadata["etag"]
+        if metadata.get("last_modified"):
+            headers["If-Modified-Since"] = metadata["last_modified"]
+
+    try:
+        response = requests.get(url, headers=headers, stream=True, timeout=TIMEOUT)
+        with response:
+            if response.status_code == 304 and metadata is not None:
+                metadata["fetched_at"] = time.time()
+                _write_metadata(meta_path, metadata)
+                return body_path
+            response.raise_for_status()
+
+            os.makedirs(os.path.dirname(body_path), exist_ok=True)
+            _write_atomic(body_path, response.iter_content(CHUNK_SIZE))
+            _write_metadata(
+                meta_path,
+                {
+                    "url": url,
+                    "etag": response.headers.get("ETag"),
+                    "last_modified": response.headers.get("Last-Modified"),
+                    "fetched_at": time.time(),
+                },
+            )
+    except requests.RequestException as e:
+        if metadata is None:
+            raise
+        print("WARNING: Using stale cached copy of {}: {}".format(url, e))
+
+    return body_path
+
+
+def urlopen(url, **kwargs):
+    """Fetch url through the cache and return the body as a binary file object"""
+    return open(fetch_file(url, **kwargs), "rb")
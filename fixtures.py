@@ -0,0 +1,192 @@
+# Record/replay of every external response the scrapers depend on.
+#
+# With FIXTURE_MODE=record, every document fetched through fetch.py and every
+# boto3 API call made through a client from ec2.client() is captured into a
+# compressed zip bundle (FIXTURE_BUNDLE, default fixtures.zip). With
+# FIXTURE_MODE=replay the same code paths are fed from that bundle and nothing
+# goes over the network, which makes scrapes reproducible for benchmarking and
+# profiling on an isolated machine:
+#
+#   FIXTURE_MODE=record invoke build
+#   FIXTURE_MODE=replay invoke build
+#
+# Recording into an existing bundle keeps the responses it already holds, a
+# response recorded again replaces the earlier one.
+import atexit
+import datetime
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+import zipfile
+
+from botocore.awsrequest import AWSResponse
+
+MODE = os.getenv("FIXTURE_MODE")
+BUNDLE = os.getenv("FIXTURE_BUNDLE", "fixtures.zip")
+
+
+def _encode(o):
+    if isinstance(o, datetime.datetime):
+        return {"__datetime__": o.isoformat()}
+    raise TypeError("Cannot record {!r}".format(o))
+
+
+def _decode(d):
+    if "__datetime__" in d:
+        return datetime.datetime.fromisoformat(d["__datetime__"])
+    return d
+
+
+def _key_default(o):
+    # Parameters like StartTime=datetime.now() must not change the key of a call
+    return "<%s>" % type(o).__name__
+
+
+def boto_key(service_name, region_name, operation_name, params):
+    call = json.dumps(
+        [service_name, region_name, operation_name, params],
+        sort_keys=True,
+        default=_key_default,
+    )
+    return "boto/%s.json" % hashlib.sha256(call.encode("utf-8")).hexdigest()
+
+
+def http_key(url):
+    return "http/%s.body" % hashlib.sha256(url.encode("utf-8")).hexdigest()
+
+
+class FixtureBundle(object):
+    """A zip bundle of recorded responses, open for recording or replaying"""
+
+    def __init__(self, path, mode):
+        if mode not in ("record", "replay"):
+            raise ValueError("Unknown fixture mode: {}".format(mode))
+        self.path = path
+        self.recording = mode == "record"
+        self.lock = threading.Lock()
+        self.closed = False
+        if self.recording:
+            # Recorded into a new bundle, which replaces the one at path on
+            # close() with the responses of earlier runs that were not
+            # recorded again added, so separate record runs add up
+            fd, self.record_path = tempfile.mkstemp(
+                prefix=".fixtures-", suffix=".zip", dir=os.path.dirname(path) or "."
+            )
+            os.close(fd)
+            self.zip = zipfile.ZipFile(self.record_path, "w", zipfile.ZIP_DEFLATED)
+            self.extract_dir = None
+        else:
+            self.zip = zipfile.ZipFile(path, "r")
+            self.extract_dir = tempfile.mkdtemp(prefix="fixtures-")
+        self.names = set(self.zip.namelist())
+
+    def close(self):
+        with self.lock:
+            if self.closed:
+                return
+            self.closed = True
+            if self.recording and os.path.exists(self.path):
+                with zipfile.ZipFile(self.path, "r") as previous:
+                    for info in previous.infolist():
+                        if info.filename not in self.names:
+                            self.zip.writestr(info, previous.read(info))
+            self.zip.close()
+            if self.recording:
+                os.replace(self.record_path, self.path)
+        if self.extract_dir:
+            shutil.rmtree(self.extract_dir, ignore_errors=True)
+
+    def _write(self, name, data=None, filename=None):
+        with self.lock:
+            # The same document or call may be requested more than once
+            if name in self.names:
+                return
+            self.names.add(name)
+            if filename is not None:
+                self.zip.write(filename, name)
+            else:
+                self.zip.writestr(name, data)
+
+    def _missing(self, name, what):
+        if name not in self.names:
+            raise KeyError("No recorded response for {} in {}".format(what, self.path))
+
+    def record_http(self, url, body_path):
+        self._write(http_key(url), filename=body_path)
+
+    def replay_http(self, url):
+        """Extract the recorded body of url and return its path"""
+        name = http_key(url)
+        self._missing(name, url)
+        with self.lock:
+            return self.zip.extract(name, self.extract_dir)
+
+    def record_boto(self, key, status_code, parsed):
+        response = {"status_code": status_code, "parsed": parsed}
+        self._write(key, json.dumps(response, default=_encode))
+
+    def replay_boto(self, key, what):
+        self._missing(key, what)
+        with self.lock:
+            response = json.loads(self.zip.read(key), object_hook=_decode)
+        return response["status_code"], response["parsed"]
+
+    def instrument(self, client):
+        """Register the record or replay handlers on a boto3 client"""
+        service_name = client.meta.service_model.service_name
+        region_name = client.meta.region_name
+        events = client.meta.events
+
+        def set_key(params, model, context, **kwargs):
+            context["fixture_key"] = boto_key(
+                service_name, region_name, model.name, params
+            )
+
+        def record(http_response, parsed, context, **kwargs):
+            self.record_boto(context["fixture_key"], http_response.status_code, parsed)
+
+        def replay(model, context, **kwargs):
+            status_code, parsed = self.replay_boto(
+                context["fixture_key"],
+                "{}.{} in {}".format(service_name, model.name, region_name),
+            )
+            return AWSResponse(None, status_code, {}, None), parsed
+
+        events.register("before-parameter-build.*.*", set_key)
+        if self.recording:
+            events.register("after-call.*.*", record)
+        else:
+            events.register("before-call.*.*", replay)
+        return client
+
+
+_bundle = None
+_bundle_lock = threading.Lock()
+
+
+def _open(path, mode):
+    global _bundle
+    if _bundle is not None:
+        _bundle.close()
+    _bundle = FixtureBundle(path, mode)
+    # A zip bundle is only readable once its central directory is written
+    atexit.register(_bundle.close)
+
+
+def activate(path, mode):
+    """Record into or replay from the bundle at path for the rest of the run"""
+    with _bundle_lock:
+        _open(path, mode)
+    return _bundle
+
+
+def active():
+    """The bundle in use, or None outside of record/replay"""
+    if _bundle is None and MODE:
+        with _bundle_lock:
+            if _bundle is None:
+                _open(BUNDLE, MODE)
+    return _bundle
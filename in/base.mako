@@ -110,10 +110,107 @@
 
     <!-- Custom JS -->
     <script type="text/javascript">
-        % if pricing_json:
+        % if pricing_header_json:
+          // Prices are fetched as binary arrays of instances x columns per
+          // region, see columnar.py for the generation side.
+          var _pricing_header = ${pricing_header_json};
+          var _pricing_arrays = {};
+          var _pricing_files = {};
+          var _pricing_rows = {};
+          var _pricing_columns = {};
+          _pricing_header["instances"].forEach(function (name, i) { _pricing_rows[name] = i; });
+          _pricing_header["columns"].forEach(function (name, i) { _pricing_columns[name] = i; });
+          _pricing_header["files"].forEach(function (file) {
+              file["regions"].forEach(function (region) { _pricing_files[region] = file; });
+          });
+          function has_pricing(region) {
+              return region in _pricing_arrays || !(region in _pricing_files);
+          }
+          function load_pricing(region, callback) {
+              // calls callback once the prices of region can be looked up
+              if (has_pricing(region)) {
+                  callback();
+                  return;
+              }
+              var file = _pricing_files[region];
+              var xhr = new XMLHttpRequest();
+              xhr.open("GET", _pricing_header["base"] + file["file"] + "?v=" + file["hash"]);
+              xhr.responseType = "arraybuffer";
+              xhr.onload = function () {
+                  // an error page or a truncated file leaves the regions
+                  // without prices, get_pricing() returns undefined for them
+                  if (xhr.status === 200 && xhr.response && xhr.response.byteLength === file["bytes"]) {
+                      var type = _pricing_header["type"] == "uint32" ? Uint32Array : Float64Array;
+                      var size = _pricing_header["instances"].length * _pricing_header["columns"].length;
+                      file["regions"].forEach(function (r, n) {
+                          _pricing_arrays[r] = new type(xhr.response, n * size * type.BYTES_PER_ELEMENT, size);
+                      });
+                  }
+                  callback();
+              };
+              xhr.onerror = function () {
+                  callback();
+              };
+              xhr.send();
+          }
+          function get_pricing(instance_type, region) {
+              var values = _pricing_arrays[region];
+              var row = _pricing_rows[instance_type];
+              var column = _pricing_columns[Array.prototype.slice.call(arguments, 2).join("|")];
+              if (values === undefined || row === undefined || column === undefined) {
+                  return undefined;
+              }
+              var v = values[row * _pricing_header["columns"].length + column];
+              if (_pricing_header["type"] == "uint32") {
+                  return v === 4294967295 ? undefined : v / _pricing_header["scale"];
+              }
+              return isNaN(v) ? undefined : v;
+          }
+        % elif pricing_json:
+          % if pricing_manifest_json:
+          // Prices are split by region, see shard_pricing in render.py. Only
+          // the default region is embedded, others are loaded on demand.
+          var _pricing_manifest = ${pricing_manifest_json};
+          var _pricing_shards = {};
+          _pricing_shards[_pricing_manifest["default"]] = ${pricing_json};
+          % else:
           var _pricing = ${pricing_json};
-          function get_pricing() {
+          % endif
+          function has_pricing(region) {
+            % if pricing_manifest_json:
+              return region in _pricing_shards || !(region in _pricing_manifest["regions"]);
+            % else:
+              return true;
+            % endif
+          }
+          function load_pricing(region, callback) {
+              // calls callback once the prices of region can be looked up
+            % if pricing_manifest_json:
+              if (has_pricing(region)) {
+                  callback();
+                  return;
+              }
+              var shard = _pricing_manifest["regions"][region];
+              $.getJSON(_pricing_manifest["base"] + shard["file"] + "?v=" + shard["hash"], function (data) {
+                  _pricing_shards[region] = data;
+                  callback();
+              }).fail(function () {
+                  // the region stays without prices, which get_pricing()
+                  // returns as undefined, and is fetched again next time
+                  callback();
+              });
+            % else:
+              callback();
+            % endif
+          }
+          function get_pricing(instance_type, region) {
               // see compress_pricing in render.py for the generation side
+            % if pricing_manifest_json:
+              var _pricing = _pricing_shards[region];
+              if (_pricing === undefined) {
+                  return undefined;
+              }
+            % endif
               v = _pricing["data"];
               for (var i = 0; i < arguments.length; i++) {
                   k = _pricing["index"][arguments[i]];
@@ -122,8 +219,12 @@
                       return undefined;
                   }
               }
-              return v;
+              // A number 0 is written by the scrapers when there is no price,
+              // a price of 0 is the string "0"
+              return v === 0 ? undefined : v;
           }
+        % endif
+        % if pricing_json or pricing_header_json:
           var _instance_azs = ${instance_azs_json};
           function get_instance_availability_zones(instance_type, region) {
             var region_azs = _instance_azs[instance_type];
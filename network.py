@@ -0,0 +1,32 @@
+# Sort order of the network performance of an instance, shared by the pages and
+# the query modules. Kept free of imports so that query.py and solver.py load
+# without the rendering stack.
+
+
+def network_sort(inst):
+    perf = inst["network_performance"]
+    network_rank = [
+        "Very Low",
+        "Low",
+        "Low to Moderate",
+        "Moderate",
+        "High",
+        "Up to 5 Gigabit",
+        "Up to 10 Gigabit",
+        "10 Gigabit",
+        "12 Gigabit",
+        "20 Gigabit",
+        "Up to 25 Gigabit",
+        "25 Gigabit",
+        "50 Gigabit",
+        "75 Gigabit",
+        "100 Gigabit",
+    ]
+    try:
+        sort = network_rank.index(perf)
+    except ValueError:
+        sort = len(network_rank)
+    sort *= 2
+    if inst.get("ebs_optimized"):
+        sort += 1
+    return sort
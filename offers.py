@@ -0,0 +1,304 @@
+# Helpers for the AWS bulk offer files (the pricing index.json of a service),
+# which are far too large to be loaded with json.load() just to throw most of
+# them away.
+#
+# The file is read as a stream: the outer objects are walked incrementally and
+# only one product or term is decoded at a time, so memory use is bounded by
+# what the caller decides to keep.
+import codecs
+import json
+
+from tqdm import tqdm
+
+import ec2
+import prices
+
+CHUNK_SIZE = 1024 * 1024
+
+PRODUCTS = ("products",)
+ON_DEMAND = ("terms", "OnDemand")
+RESERVED = ("terms", "Reserved")
+
+
+class _StreamReader(object):
+    """Minimal pull tokenizer over a text or binary file object"""
+
+    def __init__(self, f, chunk_size=CHUNK_SIZE):
+        self.f = f
+        self.chunk_size = chunk_size
+        self.utf8 = codecs.getincrementaldecoder("utf-8")()
+        self.decoder = json.JSONDecoder()
+        self.buf = ""
+        self.pos = 0
+        self.eof = False
+
+    def fill(self):
+        if self.eof:
+            return False
+        raw = self.f.read(self.chunk_size)
+        # Only an empty read is the end, a chunk ending in the middle of a
+        # multibyte character decodes to less, possibly nothing
+        if not raw:
+            self.eof = True
+        chunk = raw
+        if isinstance(raw, bytes):
+            chunk = self.utf8.decode(raw, final=self.eof)
+        self.buf = self.buf[self.pos :] + chunk
+        self.pos = 0
+        return True
+
+    def peek(self):
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in " \t\r\n":
+                self.pos += 1
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self.fill():
+                return ""
+
+    def next_char(self):
+        c = self.peek()
+        if not c:
+            raise ValueError("Unexpected end of offer file")
+        self.pos += 1
+        return c
+
+    def expect(self, expected):
+        c = self.next_char()
+        if c != expected:
+            raise ValueError(
+                "Expected {!r} at offset {} of the offer file, got {!r}".format(
+                    expected, self.pos, c
+                )
+            )
+
+    def value(self):
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buf, self.pos)
+                # A number ending at the buffer boundary may be truncated
+                if end < len(self.buf) or self.eof:
+                    self.pos = end
+                    return value
+            except ValueError:
+                if self.eof:
+                    raise
+            self.fill()
+
+
+def _walk(reader, path, sections):
+    reader.expect("{")
+    if reader.peek() == "}":
+        reader.next_char()
+        return
+    while True:
+        key = reader.value()
+        reader.expect(":")
+        child = path + (key,)
+        if path in sections:
+            yield path, key, reader.value()
+        elif reader.peek() == "{" and any(s[: len(child)] == child for s in sections):
+            yield from _walk(reader, child, sections)
+        else:
+            # Not something we were asked for, decode and drop it
+            reader.value()
+        if reader.next_char() == "}":
+            return
+
+
+def iter_offer_file(f, sections=(PRODUCTS, ON_DEMAND, RESERVED)):
+    """Stream the members of the given sections of an offer file.
+
+    Yields (section, sku, value) tuples in file order, where section is one of
+    the key paths in sections, e.g. ("terms", "OnDemand").
+    """
+    return _walk(_StreamReader(f), (), set(sections))
+
+
+# OnDemand price dimensions that are not instance hours, matched against the
+# lower cased description
+IGNORED_DIMENSIONS = [
+    "transfer",
+    "global",
+    "storage",
+    "iops",
+    "requests",
+    "multi-az",
+]
+
+RESERVED_MAPPING = {
+    "1yr All Upfront": "yrTerm1.allUpfront",
+    "1yr Partial Upfront": "yrTerm1.partialUpfront",
+    "1yr No Upfront": "yrTerm1.noUpfront",
+    "1yr Light Utilization": "yrTerm1.lightUtilization",
+    "1yr Medium Utilization": "yrTerm1.mediumUtilization",
+    "1yr Heavy Utilization": "yrTerm1.heavyUtilization",
+    "3yr All Upfront": "yrTerm3.allUpfront",
+    "3yr Partial Upfront": "yrTerm3.partialUpfront",
+    "3yr No Upfront": "yrTerm3.noUpfront",
+    "3yr Light Utilization": "yrTerm3.lightUtilization",
+    "3yr Medium Utilization": "yrTerm3.mediumUtilization",
+    "3yr Heavy Utilization": "yrTerm3.heavyUtilization",
+}
+
+
+class OfferService(object):
+    """How the SKUs of a service's offer file map onto instance records.
+
+    A service sets its product_family, the key its prices are stored under and
+    may extend the hooks below, see rds.RDSOffers and cache.CacheOffers.
+    """
+
+    name = None
+    product_family = None
+
+    # Attributes that differ between the SKUs of an instance type. They are
+    # dropped from the instance record, which is built from its first SKU.
+    sku_attributes = [
+        "location",
+        "locationType",
+        "operation",
+        "region",
+        "usagetype",
+    ]
+
+    def keep_product(self, product):
+        """Whether the SKU is of interest at all"""
+        return product.get("productFamily") == self.product_family
+
+    def prepare(self, sku, attributes):
+        """Add service specific attributes, return False to ignore the SKU"""
+        return True
+
+    def engine_keys(self, attributes):
+        """The keys under pricing[region] the prices of the SKU are stored at"""
+        raise NotImplementedError
+
+
+def _add_instance_sku(service, instances, regions, sku, product):
+    attributes = product["attributes"]
+
+    # map the region
+    location = ec2.canonicalize_location(attributes["location"])
+    instance_type = attributes["instanceType"]
+    try:
+        region = regions[location]
+    except KeyError:
+        if location == "Any":
+            region = "us-east-1"
+        else:
+            print(
+                f"ERROR: No region data for location={location}. Ignoring instance with sku={sku}, type={instance_type}"
+            )
+            return None
+
+    # set the attributes in line with the ec2 index
+    attributes["region"] = region
+    attributes["memory"] = attributes["memory"].split(" ")[0]
+    attributes["network_performance"] = attributes.get("networkPerformance", None)
+    attributes["family"] = attributes["instanceFamily"]
+    attributes["instance_type"] = instance_type
+    if not service.prepare(sku, attributes):
+        return None
+    attributes["pricing"] = {}
+
+    instance = instances.get(instance_type)
+    if instance is None:
+        # delete the attributes that are inconsistent among skus
+        instance = attributes.copy()
+        for key in service.sku_attributes:
+            instance.pop(key, None)
+        instance["pricing"] = {region: {}}
+        instances[instance_type] = instance
+
+    # Everything the terms of this SKU need, resolved once
+    return instance["pricing"], region, service.engine_keys(attributes)
+
+
+def _add_ondemand_terms(target, offers):
+    pricing, region, engine_keys = target
+    for offer in offers.values():
+        for dimension in offer["priceDimensions"].values():
+            # skip these for now
+            description = dimension["description"].lower()
+            if any(descr in description for descr in IGNORED_DIMENSIONS):
+                continue
+            price = float(dimension["pricePerUnit"]["USD"])
+            region_pricing = pricing.setdefault(region, {})
+            for key in engine_keys:
+                region_pricing.setdefault(key, {})["ondemand"] = price
+
+
+def _add_reserved_terms(target, offers):
+    pricing, region, engine_keys = target
+    region_pricing = pricing.setdefault(region, {})
+    for offer in offers.values():
+        reserved_type = "%s %s" % (
+            offer["termAttributes"]["LeaseContractLength"],
+            offer["termAttributes"]["PurchaseOption"],
+        )
+        term = RESERVED_MAPPING[reserved_type]
+        for dimension in offer["priceDimensions"].values():
+            price = float(dimension["pricePerUnit"]["USD"])
+            reserved_key = "%s-%s" % (term, dimension["unit"].lower())
+            for key in engine_keys:
+                region_pricing.setdefault(key, {}).setdefault("reserved", {})[
+                    reserved_key
+                ] = price
+
+
+def parse_offer_file(f, service):
+    """Build the instance records of a service from its offer file.
+
+    Products and terms are handled in a single streaming pass. The pricing
+    target of every kept SKU is resolved once, when its product is read, so
+    the terms are written straight into the instance records and never kept.
+    AWS writes the products before the terms, which this relies on.
+
+    Returns a dict of instance_type -> instance record.
+    """
+    # region mapping, someone thought it was handy not to include the region id's :(
+    regions = ec2.get_region_descriptions()
+
+    instances = {}
+    targets = {}
+    products_done = False
+    offers = tqdm(iter_offer_file(f), desc=service.name, unit=" offers")
+    for section, sku, value in offers:
+        if section == PRODUCTS:
+            if products_done:
+                raise ValueError("Offer file has products after its terms")
+            if service.keep_product(value):
+                target = _add_instance_sku(service, instances, regions, sku, value)
+                if target is not None:
+                    targets[sku] = target
+            continue
+
+        products_done = True
+        target = targets.get(sku)
+        if target is None:
+            continue
+        if section == ON_DEMAND:
+            _add_ondemand_terms(target, value)
+        else:
+            _add_reserved_terms(target, value)
+
+    # Calculate all reserved effective pricings in one batch
+    reserved = prices.ReservedPrices()
+    for instance_type, instance in instances.items():
+        for region, pricing in instance["pricing"].items():
+            for engine, engine_prices in pricing.items():
+                if "reserved" not in engine_prices:
+                    continue
+                try:
+                    reserved.add_offer_terms(engine_prices)
+                except Exception as e:
+                    print(
+                        "ERROR: Trouble generating {} reserved price for {}: {!r}".format(
+                            service.name, instance_type, e
+                        )
+                    )
+    reserved.apply()
+
+    return instances
@@ -0,0 +1,115 @@
+# Price math shared by the EC2, RDS and Cache scrapers.
+#
+# Effective reserved prices are not calculated one dict entry at a time while
+# the pricing data is parsed. The terms of a whole run are collected as rows in
+# a ReservedPrices batch instead, computed in one go over flat float arrays and
+# only then written back (and formatted) into the pricing dicts.
+from array import array
+from operator import add, truediv
+
+# Effective reserved terms of the offer file based services (RDS, Cache):
+# (term, lease in years, upfront key or None, hourly key)
+# Light, Medium and Heavy utilization are from previous generations and are not
+# available for choosing anymore in the AWS console, so they are not calculated.
+OFFER_RESERVED_TERMS = [
+    (
+        "yrTerm3Standard.partialUpfront",
+        3,
+        "yrTerm3.partialUpfront-quantity",
+        "yrTerm3.partialUpfront-hrs",
+    ),
+    (
+        "yrTerm1Standard.partialUpfront",
+        1,
+        "yrTerm1.partialUpfront-quantity",
+        "yrTerm1.partialUpfront-hrs",
+    ),
+    (
+        "yrTerm3Standard.allUpfront",
+        3,
+        "yrTerm3.allUpfront-quantity",
+        "yrTerm3.allUpfront-hrs",
+    ),
+    ("yrTerm1Standard.noUpfront", 1, None, "yrTerm1.noUpfront-hrs"),
+    ("yrTerm3Standard.noUpfront", 3, None, "yrTerm3.noUpfront-hrs"),
+]
+
+
+def format_price(price):
+    """Format a price with at most 6 decimals and no trailing zeros"""
+    price = float(price)
+    if 0 < abs(price) < 0.0001:
+        # Keep the exponent notation str() uses for tiny values
+        return str(float("%f" % price)).rstrip("0").rstrip(".")
+    return ("%f" % price).rstrip("0").rstrip(".")
+
+
+def effective_prices(upfront, hourly, lease_units, unit_hours):
+    """Spread upfront prices over their lease and add the hourly price.
+
+    Takes equally long sequences of floats and returns a list with the
+    effective hourly price upfront / lease_units / unit_hours + hourly of
+    every row, computed column by column:
+
+    >>> effective_prices([876.0, 0.0], [0.5, 0.25], [8760.0, 365.0], [1.0, 24.0])
+    [0.6, 0.25]
+    """
+    spread = map(truediv, map(truediv, upfront, lease_units), unit_hours)
+    return list(map(add, spread, hourly))
+
+
+class ReservedPrices(object):
+    """A batch of reserved terms, stored as columns.
+
+    Every row is written to target[key] by apply(), in the order the rows were
+    added.
+    """
+
+    def __init__(self):
+        self.targets = []
+        self.upfront = array("d")
+        self.hourly = array("d")
+        self.lease_units = array("d")
+        self.unit_hours = array("d")
+
+    def __len__(self):
+        return len(self.targets)
+
+    def _add(self, target, key, upfront, hourly, lease_units, unit_hours):
+        self.targets.append((target, key))
+        self.upfront.append(float(upfront))
+        self.hourly.append(float(hourly))
+        self.lease_units.append(lease_units)
+        self.unit_hours.append(unit_hours)
+
+    def add(self, target, key, upfront, hourly, lease_years):
+        """Queue an EC2 term, upfront is spread over the hours of the lease"""
+        self._add(target, key, upfront, hourly, lease_years * 365 * 24, 1.0)
+
+    def add_offer_terms(self, prices):
+        """Queue the effective prices of a raw RDS/Cache "reserved" dict.
+
+        The upfront price is spread over the days of the lease, then over the
+        hours of a day. prices["reserved"] is replaced by the dict the
+        effective prices will be written to. A KeyError is raised, and prices
+        is left untouched, if an upfront price comes without its hourly
+        counterpart.
+        """
+        reserved = prices["reserved"]
+        rows = []
+        for term, lease_years, upfront_key, hourly_key in OFFER_RESERVED_TERMS:
+            if (upfront_key or hourly_key) not in reserved:
+                continue
+            upfront = reserved[upfront_key] if upfront_key else 0.0
+            rows.append((term, upfront, reserved[hourly_key], 365 * lease_years, 24.0))
+
+        prices["reserved"] = effective = {}
+        for row in rows:
+            self._add(effective, *row)
+
+    def apply(self, formatter=None):
+        prices = effective_prices(
+            self.upfront, self.hourly, self.lease_units, self.unit_hours
+        )
+        for (target, key), price in zip(self.targets, prices):
+            target[key] = formatter(price) if formatter else price
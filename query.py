@@ -0,0 +1,167 @@
+# Indexed queries over the instances written by scrape.py, e.g. all instances
+# with at least 16 vCPUs and 64 GiB of memory under $1/h in eu-west-1:
+#
+#   index = query.InstanceIndex.load("www/instances.json")
+#   index.select(
+#       region="eu-west-1", vCPU=(16, None), memory=(64, None), price=(None, 1)
+#   )
+#
+# Every column is kept as a list of values by row and as the row numbers sorted
+# by value. A query counts the rows of every condition in the sorted indexes,
+# starts from the most selective one and checks the rest against the columns
+# of those rows only, so it touches a fraction of the instances.
+import bisect
+import json
+import threading
+
+from network import network_sort
+
+# Numeric columns that can be queried with a range
+COLUMNS = {
+    "vCPU": lambda i: i.get("vCPU"),
+    "memory": lambda i: i.get("memory"),
+    "GPU": lambda i: i.get("GPU"),
+    "GPU_memory": lambda i: i.get("GPU_memory"),
+    "network_sort": network_sort,
+}
+
+
+def price(instance, region, platform="linux", term="ondemand"):
+    """The hourly price of instance as a float, or None if it has none.
+
+    term is "ondemand", "spot_min", "spot_max" or a reserved term like
+    "yrTerm1Standard.noUpfront".
+    """
+    try:
+        prices = instance["pricing"][region][platform]
+    except KeyError:
+        return None
+    value = prices.get(term)
+    if value is None:
+        value = prices.get("reserved", {}).get(term)
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class SortedIndex(object):
+    """The values of a column by row, and the rows sorted by value"""
+
+    def __init__(self, values):
+        self.values = values
+        pairs = sorted((v, n) for n, v in enumerate(values) if v is not None)
+        self.sorted_values = [v for v, _ in pairs]
+        self.rows = [n for _, n in pairs]
+
+    def _bounds(self, lo, hi):
+        start = 0 if lo is None else bisect.bisect_left(self.sorted_values, lo)
+        end = (
+            len(self.sorted_values)
+            if hi is None
+            else bisect.bisect_right(self.sorted_values, hi)
+        )
+        return start, max(start, end)
+
+    def count(self, lo=None, hi=None):
+        start, end = self._bounds(lo, hi)
+        return end - start
+
+    def range(self, lo=None, hi=None):
+        """The rows with lo <= value <= hi, None leaves a side open"""
+        start, end = self._bounds(lo, hi)
+        return self.rows[start:end]
+
+    def matches(self, n, lo=None, hi=None):
+        v = self.values[n]
+        return v is not None and (lo is None or v >= lo) and (hi is None or v <= hi)
+
+
+class InstanceIndex(object):
+    """The instances of instances.json, indexed for select()"""
+
+    def __init__(self, instances):
+        self.instances = instances
+        self.columns = {
+            name: SortedIndex([value(i) for i in instances])
+            for name, value in COLUMNS.items()
+        }
+        # Architecture -> rows
+        self.arch = {}
+        for n, i in enumerate(instances):
+            for arch in i.get("arch") or []:
+                self.arch.setdefault(arch, set()).add(n)
+        self._prices = {}
+        self._prices_lock = threading.Lock()
+
+    @classmethod
+    def load(cls, data_file):
+        with open(data_file, "r") as f:
+            return cls(json.load(f))
+
+    def prices(self, region, platform="linux", term="ondemand"):
+        """The price index of a region, platform and term, built on first use"""
+        key = (region, platform, term)
+        index = self._prices.get(key)
+        if index is None:
+            with self._prices_lock:
+                index = self._prices.get(key)
+                if index is None:
+                    index = self._prices[key] = SortedIndex(
+                        [price(i, region, platform, term) for i in self.instances]
+                    )
+        return index
+
+    def select_rows(
+        self, region=None, platform="linux", term="ondemand", arch=None, **ranges
+    ):
+        """The rows matching all conditions, see select()"""
+        # (number of rows, rows, test of a row)
+        conditions = []
+        for name, bounds in ranges.items():
+            if name == "price":
+                if region is None:
+                    raise ValueError("Querying prices needs a region")
+                index = self.prices(region, platform, term)
+            elif name in self.columns:
+                index = self.columns[name]
+            else:
+                raise ValueError("Unknown column: {}".format(name))
+            lo, hi = bounds
+            conditions.append(
+                (
+                    index.count(lo, hi),
+                    lambda index=index, lo=lo, hi=hi: index.range(lo, hi),
+                    lambda n, index=index, lo=lo, hi=hi: index.matches(n, lo, hi),
+                )
+            )
+        if region is not None and "price" not in ranges:
+            # Only instances available in the region
+            index = self.prices(region, platform, term)
+            conditions.append((index.count(), index.range, index.matches))
+        if arch is not None:
+            arch_rows = self.arch.get(arch, set())
+            conditions.append(
+                (len(arch_rows), lambda: arch_rows, arch_rows.__contains__)
+            )
+
+        if not conditions:
+            return list(range(len(self.instances)))
+        conditions.sort(key=lambda c: c[0])
+        _, first_rows, _ = conditions[0]
+        tests = [test for _, _, test in conditions[1:]]
+        return sorted(n for n in first_rows() if all(test(n) for test in tests))
+
+    def select(
+        self, region=None, platform="linux", term="ondemand", arch=None, **ranges
+    ):
+        """The instances matching all conditions, in the order of instances.
+
+        ranges are (lo, hi) bounds, both inclusive and None for no bound, of a
+        column in COLUMNS or of "price", the price in region for platform and
+        term. With a region, only instances with such a price are selected.
+        """
+        return [
+            self.instances[n]
+            for n in self.select_rows(region, platform, term, arch, **ranges)
+        ]
@@ -1,44 +1,21 @@
-import mako.template
-import mako.lookup
 import mako.exceptions
 import io
 import json
 import datetime
+import hashlib
 import os
-
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import columnar
+import compress
+import detail_pages
+import templates
+from network import network_sort
 from detail_pages_rds import build_detail_pages_rds
 from detail_pages_ec2 import build_detail_pages_ec2
 
 
-def network_sort(inst):
-    perf = inst["network_performance"]
-    network_rank = [
-        "Very Low",
-        "Low",
-        "Low to Moderate",
-        "Moderate",
-        "High",
-        "Up to 5 Gigabit",
-        "Up to 10 Gigabit",
-        "10 Gigabit",
-        "12 Gigabit",
-        "20 Gigabit",
-        "Up to 25 Gigabit",
-        "25 Gigabit",
-        "50 Gigabit",
-        "75 Gigabit",
-        "100 Gigabit",
-    ]
-    try:
-        sort = network_rank.index(perf)
-    except ValueError:
-        sort = len(network_rank)
-    sort *= 2
-    if inst.get("ebs_optimized"):
-        sort += 1
-    return sort
-
-
 def add_cpu_detail(i):
     try:
         i["ECU_per_vcpu"] = i["ECU"] / i["vCPU"]
@@ -65,37 +42,118 @@ def add_render_info(i):
     add_cpu_detail(i)
 
 
-prices_dict = {}
-prices_index = 0
-
-
-def _compress_pricing(d):
-    global prices_index
-
-    for k, v in d.items():
-        if k in prices_dict:
-            nk = prices_dict[k]
-        else:
-            prices_dict[k] = nk = prices_index
-            prices_index += 1
-
-        if isinstance(v, dict):
-            nv = dict(_compress_pricing(v))
-        else:
-            nv = v
-
-        yield nk, nv
-
-
-def compress_pricing(instances):
-    global prices_index
-
-    prices = {i["instance_type"]: i["pricing"] for i in instances}
+class PricingEncoder(object):
+    """Encodes nested pricing dicts with their keys replaced by integers.
+
+    The result is a JSON object with the encoded dicts under "data" and the
+    ids of the keys used under "index", see get_pricing() in base.mako for
+    the decoding side. ids maps keys to their ids and is kept by the encoder,
+    not the module, so separate encoders can run at the same time. Passing
+    the same ids to encoders used one after the other gives a key the same id
+    in the pricing of all of them.
+    """
+
+    def __init__(self, ids=None):
+        self.ids = {} if ids is None else ids
+
+    def _encode(self, d, index):
+        encoded = {}
+        for k, v in d.items():
+            nk = index.get(k)
+            if nk is None:
+                nk = self.ids.get(k)
+                if nk is None:
+                    nk = self.ids[k] = len(self.ids)
+                index[k] = nk
+            encoded[nk] = self._encode(v, index) if isinstance(v, dict) else v
+        return encoded
+
+    def encode(self, instances):
+        index = {}
+        prices = {i["instance_type"]: i["pricing"] for i in instances}
+        data = self._encode(prices, index)
+        return json.dumps({"index": index, "data": data})
+
+
+def compress_pricing(instances, ids=None):
+    return PricingEncoder(ids).encode(instances)
+
+
+# Write the prices of every region to a file of their own next to the page, and
+# only embed the prices of DEFAULT_REGION in it. The other regions are fetched
+# when they are selected. Set PRICING_SHARDS=1 to render this way.
+PRICING_SHARDS = os.getenv("PRICING_SHARDS", "0") == "1"
+DEFAULT_REGION = "us-east-1"
+PRICING_MANIFEST = "manifest.json"
+
+
+def url_path(path):
+    """The URL path a file or directory under www/ is served at"""
+    return "/" + os.path.relpath(path, "www").replace(os.sep, "/")
+
+
+def region_pricing(instances, region):
+    """compress_pricing() output with the prices of a single region"""
+    return compress_pricing(
+        [
+            {
+                "instance_type": i["instance_type"],
+                "pricing": {region: i["pricing"][region]},
+            }
+            for i in instances
+            if region in i["pricing"]
+        ]
+    )
 
-    prices_dict.clear()
-    prices_index = 0
 
-    return json.dumps({"index": prices_dict, "data": dict(_compress_pricing(prices))})
+def shard_pricing(instances, pricing_dir, base_url):
+    """Write the prices of every region to a file of its own in pricing_dir.
+
+    pricing_dir is served at base_url. Writes a manifest next to the files and
+    returns it: the base URL of the files and the file name, content hash and
+    size of every region.
+    """
+    regions = sorted({region for i in instances for region in i["pricing"]})
+    os.makedirs(pricing_dir, exist_ok=True)
+    manifest = {"base": base_url, "default": DEFAULT_REGION, "regions": {}}
+    for region in regions:
+        data = region_pricing(instances, region).encode("utf-8")
+        file_name = region + ".json"
+        with open(os.path.join(pricing_dir, file_name), "wb") as f:
+            f.write(data)
+        manifest["regions"][region] = {
+            "file": file_name,
+            "hash": hashlib.sha256(data).hexdigest()[:16],
+            "bytes": len(data),
+        }
+    with open(os.path.join(pricing_dir, PRICING_MANIFEST), "w") as f:
+        json.dump(manifest, f, indent=1)
+    return manifest
+
+
+# Set PRICING_FORMAT=columnar to have the pages fetch their prices as binary
+# arrays, see columnar.py. Combined with PRICING_SHARDS=1 there is a file per
+# region, otherwise one for all regions.
+PRICING_FORMAT = os.getenv("PRICING_FORMAT", "json")
+
+
+def write_columnar_pricing(instances, pricing_dir, base_url, shards=False):
+    """Write the prices in the columnar format to pricing_dir.
+
+    Returns the header the page needs to fetch and decode them.
+    """
+    pricing = columnar.ColumnarPricing(instances)
+    os.makedirs(pricing_dir, exist_ok=True)
+    if shards:
+        files = [
+            pricing.write(os.path.join(pricing_dir, region + ".bin"), [region])
+            for region in pricing.regions
+        ]
+    else:
+        files = [
+            pricing.write(os.path.join(pricing_dir, "prices.bin"), pricing.regions)
+        ]
+    return pricing.header(base_url, files)
 
 
 def compress_instance_azs(instances):
@@ -110,8 +168,7 @@ def compress_instance_azs(instances):
 
 def about_page(destination_file="www/about.html"):
     print("Rendering to %s..." % destination_file)
-    lookup = mako.lookup.TemplateLookup(directories=["."])
-    template = mako.template.Template(filename="in/about.html.mako", lookup=lookup)
+    template = templates.get_template("in/about.html.mako")
     generated_at = datetime.datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S UTC")
     os.makedirs(os.path.dirname(destination_file), exist_ok=True)
     with io.open(destination_file, "w+", encoding="utf-8") as fh:
@@ -138,25 +195,58 @@ def build_sitemap(sitemap):
         fp.write("\n".join(surls))
 
 
-def render(data_file, template_file, destination_file):
-    """Build the HTML content from scraped data"""
-    lookup = mako.lookup.TemplateLookup(directories=["."])
-    template = mako.template.Template(filename=template_file, lookup=lookup)
+def load_instances(data_file):
     with open(data_file, "r") as f:
         instances = json.load(f)
 
     print("Loading data from %s..." % data_file)
     for i in instances:
         add_render_info(i)
-    pricing_json = compress_pricing(instances)
+    return instances
+
+
+def render_detail_pages(data_file, instances, destination_file, workers=None):
+    """Render the detail pages of the service of data_file, if it has any.
+
+    The pages are rendered by up to workers processes, RENDER_WORKERS by
+    default. Returns their sitemap.
+    """
+    if data_file == "www/instances.json":
+        return build_detail_pages_ec2(instances, destination_file, workers)
+    elif data_file == "www/rds/instances.json":
+        return build_detail_pages_rds(instances, destination_file, workers)
+    return []
+
+
+def render(data_file, template_file, destination_file, workers=None, details=True):
+    """Build the HTML content from scraped data.
+
+    The detail pages are rendered too, by up to workers processes, unless
+    details is False.
+    """
+    template = templates.get_template(template_file)
+    instances = load_instances(data_file)
+    pricing_json = pricing_manifest_json = pricing_header_json = None
+    pricing_dir = os.path.join(os.path.dirname(destination_file), "pricing")
+    if PRICING_FORMAT == "columnar":
+        header = write_columnar_pricing(
+            instances, pricing_dir, url_path(pricing_dir) + "/", PRICING_SHARDS
+        )
+        pricing_header_json = json.dumps(header)
+    elif PRICING_SHARDS:
+        manifest = shard_pricing(instances, pricing_dir, url_path(pricing_dir) + "/")
+        pricing_manifest_json = json.dumps(manifest)
+        pricing_json = region_pricing(instances, DEFAULT_REGION)
+    else:
+        pricing_json = compress_pricing(instances)
     generated_at = datetime.datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S UTC")
     instance_azs_json = compress_instance_azs(instances)
 
     sitemap = []
-    if data_file == "www/instances.json":
-        sitemap.extend(build_detail_pages_ec2(instances, destination_file))
-    elif data_file == "www/rds/instances.json":
-        sitemap.extend(build_detail_pages_rds(instances, destination_file))
+    if details:
+        sitemap.extend(
+            render_detail_pages(data_file, instances, destination_file, workers)
+        )
 
     print("Rendering to %s..." % destination_file)
     os.makedirs(os.path.dirname(destination_file), exist_ok=True)
@@ -166,6 +256,8 @@ def render(data_file, template_file, destination_file):
                 template.render(
                     instances=instances,
                     pricing_json=pricing_json,
+                    pricing_manifest_json=pricing_manifest_json,
+                    pricing_header_json=pricing_header_json,
                     generated_at=generated_at,
                     instance_azs_json=instance_azs_json,
                 )
@@ -177,14 +269,60 @@ def render(data_file, template_file, destination_file):
     return sitemap
 
 
-if __name__ == "__main__":
+# (data file, template, destination) of the main page of every service
+SERVICE_PAGES = [
+    ("www/instances.json", "in/index.html.mako", "www/index.html"),
+    ("www/rds/instances.json", "in/rds.html.mako", "www/rds/index.html"),
+    ("www/cache/instances.json", "in/cache.html.mako", "www/cache/index.html"),
+]
+
+
+def _timed_render(data_file, template_file, destination_file, details=True):
+    start = time.perf_counter()
+    sitemap = render(data_file, template_file, destination_file, details=details)
+    return sitemap, time.perf_counter() - start
+
+
+def render_all(pages=SERVICE_PAGES, workers=None):
+    """Render the pages of every service, then the about page and sitemap,
+    and compress everything in www/.
+
+    The main pages of the services are rendered in parallel worker processes,
+    up to workers (RENDER_WORKERS by default) at a time, and 1 renders them
+    one after the other in this process. The detail pages of the services
+    are rendered next, one service after the other, each by a pool of up to
+    workers processes. Returns the sitemap.
+    """
+    workers = workers or detail_pages.RENDER_WORKERS
+    service_workers = min(workers, len(pages))
+    start = time.perf_counter()
+    if service_workers <= 1:
+        results = [_timed_render(*page) for page in pages]
+    else:
+        with ProcessPoolExecutor(max_workers=service_workers) as executor:
+            futures = [
+                executor.submit(_timed_render, *page, details=False) for page in pages
+            ]
+            results = [future.result() for future in futures]
+        for n, (data_file, _, destination_file) in enumerate(pages):
+            detail_start = time.perf_counter()
+            detail_sitemap = render_detail_pages(
+                data_file, load_instances(data_file), destination_file, workers
+            )
+            page_sitemap, seconds = results[n]
+            seconds += time.perf_counter() - detail_start
+            results[n] = (detail_sitemap + page_sitemap, seconds)
+
     sitemap = []
-    sitemap.extend(render("www/instances.json", "in/index.html.mako", "www/index.html"))
-    sitemap.extend(
-        render("www/rds/instances.json", "in/rds.html.mako", "www/rds/index.html")
-    )
-    sitemap.extend(
-        render("www/cache/instances.json", "in/cache.html.mako", "www/cache/index.html")
-    )
+    for (_, _, destination_file), (page_sitemap, seconds) in zip(pages, results):
+        print("Rendered %s in %.1fs" % (destination_file, seconds))
+        sitemap.extend(page_sitemap)
     sitemap.append(about_page())
     build_sitemap(sitemap)
+    compress.compress_tree("www", workers)
+    print("Rendered all pages in %.1fs" % (time.perf_counter() - start))
+    return sitemap
+
+
+if __name__ == "__main__":
+    render_all()
@@ -0,0 +1,153 @@
+# Differential upload of www/ to the S3 bucket of the site.
+#
+# Every file is compared with the ETag of its key in the bucket, which is the
+# MD5 of the object for the single part uploads made here, and only new and
+# changed files are uploaded, by a pool of threads sharing one client. Keys
+# without a local file are left alone unless deleting them is asked for.
+#
+# Set S3_ENDPOINT_URL to sync with a local S3 stand-in (e.g. moto_server or
+# MinIO) instead of AWS:
+#
+#   S3_ENDPOINT_URL=http://127.0.0.1:5000 invoke deploy
+import gzip
+import hashlib
+import mimetypes
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import boto3
+
+import compress
+
+S3_ENDPOINT_URL = os.getenv("S3_ENDPOINT_URL")
+S3_REGION = os.getenv("S3_REGION", "us-east-1")
+UPLOAD_WORKERS = int(os.getenv("UPLOAD_WORKERS", "16"))
+# The most keys a single DeleteObjects request accepts
+DELETE_BATCH = 1000
+
+
+class LocalFile(object):
+    """The body and headers a file in www/ is uploaded with"""
+
+    def __init__(self, path, name):
+        self.path = path
+        self.content_type = mimetypes.guess_type(name)[0] or "application/octet-stream"
+        self.content_encoding = None
+        # Upload the precompressed variant, S3 does not negotiate encodings
+        gz_path = compress.variant(path, ".gz")
+        if gz_path:
+            self.path = gz_path
+            self.content_encoding = "gzip"
+        # HTML without a variant is gzipped when it is read
+        self.gzip = self.content_encoding is None and name.endswith(".html")
+        if self.gzip:
+            self.content_encoding = "gzip"
+
+    def read(self):
+        with open(self.path, "rb") as f:
+            body = f.read()
+        if self.gzip:
+            # Without mtime the same page always gzips to the same bytes
+            body = gzip.compress(body, mtime=0)
+        return body
+
+    def etag(self):
+        return hashlib.md5(self.read()).hexdigest()
+
+
+def local_files(root_dir):
+    """The files to upload, by key"""
+    skip = tuple(compress.ENCODINGS.values())
+    files = {}
+    for root, dirs, names in os.walk(root_dir):
+        dirs[:] = [d for d in dirs if not d.startswith(".")]
+        for name in names:
+            # Variants are uploaded in place of the file they belong to
+            if name.startswith(".") or name.endswith(skip):
+                continue
+            path = os.path.join(root, name)
+            key = os.path.relpath(path, root_dir).replace(os.sep, "/")
+            files[key] = LocalFile(path, name)
+    return files
+
+
+def remote_etags(client, bucket):
+    """The ETag of every key in bucket"""
+    etags = {}
+    paginator = client.get_paginator("list_objects_v2")
+    for page in paginator.paginate(Bucket=bucket):
+        for obj in page.get("Contents", []):
+            etags[obj["Key"]] = obj["ETag"].strip('"')
+    return etags
+
+
+def _upload(client, bucket, key, local):
+    body = local.read()
+    args = {
+        "Bucket": bucket,
+        "Key": key,
+        "Body": body,
+        "ACL": "public-read",
+        "ContentType": local.content_type,
+    }
+    if local.content_encoding:
+        args["ContentEncoding"] = local.content_encoding
+    client.put_object(**args)
+    return len(body)
+
+
+def sync(root_dir, bucket, client=None, workers=UPLOAD_WORKERS, delete=False):
+    """Upload the new and changed files in root_dir to bucket.
+
+    With delete, keys that have no file in root_dir are deleted from the
+    bucket. Returns the number of files and bytes uploaded and keys deleted.
+    """
+    client = client or boto3.session.Session().client(
+        "s3", region_name=S3_REGION, endpoint_url=S3_ENDPOINT_URL
+    )
+    files = local_files(root_dir)
+    etags = remote_etags(client, bucket)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        # Hashing reads every file, so it runs in the pool as well
+        local_etags = dict(zip(files, executor.map(LocalFile.etag, files.values())))
+        changed = [key for key in sorted(files) if etags.get(key) != local_etags[key]]
+        print("Uploading %d of %d files to %s..." % (len(changed), len(files), bucket))
+        futures = [
+            executor.submit(_upload, client, bucket, key, files[key]) for key in changed
+        ]
+        uploaded_bytes = sum(future.result() for future in futures)
+
+    stale = sorted(set(etags) - set(files))
+    deleted = 0
+    failed = 0
+    if delete:
+        for start in range(0, len(stale), DELETE_BATCH):
+            batch = stale[start : start + DELETE_BATCH]
+            response = client.delete_objects(
+                Bucket=bucket,
+                Delete={"Objects": [{"Key": key} for key in batch], "Quiet": True},
+            )
+            # Quiet responses only list the keys that could not be deleted
+            errors = response.get("Errors", [])
+            for error in errors:
+                print(
+                    "ERROR: Could not delete %s: %s %s"
+                    % (error.get("Key"), error.get("Code"), error.get("Message"))
+                )
+            failed += len(errors)
+            deleted += len(batch) - len(errors)
+
+    print(
+        "Uploaded %d files (%d bytes), %d unchanged, %d deleted, %d stale kept"
+        % (
+            len(changed),
+            uploaded_bytes,
+            len(files) - len(changed),
+            deleted,
+            len(stale) - deleted,
+        )
+    )
+    if failed:
+        raise RuntimeError("Could not delete %d keys from %s" % (failed, bucket))
+    return len(changed), uploaded_bytes, deleted
@@ -5,13 +5,18 @@ import json
 import locale
 import ec2
 import os
-from six.moves.urllib import request as urllib2
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import fetch
 
 # Following advice from https://stackoverflow.com/a/1779324/216138
 # The locale must be installed in the system, and it must be one where ',' is
 # the thousans separator and '.' is the decimal fraction separator.
 locale.setlocale(locale.LC_ALL, "en_US.UTF-8")
 
+# Number of enrichment stages allowed to run at the same time, see run_stages()
+SCRAPE_WORKERS = int(os.getenv("SCRAPE_WORKERS", "8"))
+
 
 class Instance(object):
     def __init__(self):
@@ -248,7 +253,8 @@ def add_pricing_info(instances):
 
 
 def fetch_data(url):
-    content = urllib2.urlopen(url).read().decode()
+    with fetch.urlopen(url) as f:
+        content = f.read().decode()
     try:
         pricing = json.loads(content)
     except ValueError:
@@ -267,7 +273,8 @@ def add_eni_info(instances):
     # eni_url = "https://docs.aws.amazon.com/AWSEC2/latest/UserGuide/using-eni.partial.html"
     # It seems it's no longer dynamically loaded
     eni_url = "https://docs.aws.amazon.com/AWSEC2/latest/UserGuide/using-eni.html"
-    tree = etree.parse(urllib2.urlopen(eni_url), etree.HTMLParser())
+    with fetch.urlopen(eni_url) as f:
+        tree = etree.parse(f, etree.HTMLParser())
     table = tree.xpath('//div[@class="table-contents"]//table')[1]
     rows = table.xpath(".//tr[./td]")
     by_type = {i.instance_type: i for i in instances}
@@ -370,7 +377,8 @@ def add_ebs_info(instances):
     # ebs_url = "https://docs.aws.amazon.com/AWSEC2/latest/UserGuide/ebs-optimized.partial.html"
     # It seems it's no longer dynamically loaded
     ebs_url = "https://docs.aws.amazon.com/AWSEC2/latest/UserGuide/ebs-optimized.html"
-    tree = etree.parse(urllib2.urlopen(ebs_url), etree.HTMLParser())
+    with fetch.urlopen(ebs_url) as f:
+        tree = etree.parse(f, etree.HTMLParser())
     tables = tree.xpath('//div[@class="table-contents"]//table')
     parse_ebs_table(by_type, tables[0], True)
     parse_ebs_baseline_table(by_type, tables[1])
@@ -386,7 +394,8 @@ def add_linux_ami_info(instances):
     """
     checkmark_char = "\u2713"
     url = "http://aws.amazon.com/amazon-linux-ami/instance-type-matrix/"
-    tree = etree.parse(urllib2.urlopen(url), etree.HTMLParser())
+    with fetch.urlopen(url) as f:
+        tree = etree.parse(f, etree.HTMLParser())
     table = tree.xpath('//div[@class="aws-table"]/table')[0]
     rows = table.xpath(".//tr[./td]")[1:]  # ignore header
 
@@ -460,7 +469,8 @@ def add_instance_storage_details(instances):
     # url = "https://docs.aws.amazon.com/AWSEC2/latest/UserGuide/InstanceStorage.partial.html"
     # It seems it's no longer dynamically loaded
     url = "http://docs.aws.amazon.com/AWSEC2/latest/UserGuide/InstanceStorage.html"
-    tree = etree.parse(urllib2.urlopen(url), etree.HTMLParser())
+    with fetch.urlopen(url) as f:
+        tree = etree.parse(f, etree.HTMLParser())
     table = tree.xpath('//div[@class="table-contents"]/table')[0]
     rows = table.xpath(".//tr[./td]")
 
@@ -513,7 +523,8 @@ def add_t2_credits(instances):
     # url = "https://docs.aws.amazon.com/AWSEC2/latest/UserGuide/burstable-credits-baseline-concepts.partial.html"
     # It seems it's no longer dynamically loaded
     url = "http://docs.aws.amazon.com/AWSEC2/latest/UserGuide/t2-credits-baseline-concepts.html"
-    tree = etree.parse(urllib2.urlopen(url), etree.HTMLParser())
+    with fetch.urlopen(url) as f:
+        tree = etree.parse(f, etree.HTMLParser())
     table = tree.xpath('//div[@class="table-contents"]//table')[1]
     rows = table.xpath(".//tr[./td]")
     assert len(rows) > 0, "Failed to find T2 CPU credit info"
@@ -967,32 +978,42 @@ def add_gpu_info(instances):
         inst.GPU_memory = inst_gpu_data["gpu_memory"]
 
 
-def add_availability_zone_info(instances):
+def _region_availability_zones(region_name):
+    """Collect the availability zone ids of every instance type in one region"""
+    region_azs = {}
+    for offering in ec2.describe_instance_type_offerings(
+        region_name=region_name, location_type="availability-zone-id"
+    ):
+        region_azs.setdefault(offering["InstanceType"], set()).add(offering["Location"])
+    return region_name, region_azs
+
+
+def add_availability_zone_info(instances, max_workers=None):
     """
     Add info about availability zones using information from the following APIs:
         - aws ec2 describe-instance-type-offerings --region us-east-1
         - aws ec2 describe-instance-type-offerings --location-type availability-zone --region us-east-1
         - aws ec2 describe-availability-zones --region us-east-1
     https://docs.aws.amazon.com/cli/latest/reference/ec2/describe-instance-type-offerings.html
+
+    Regions are queried concurrently, up to max_workers (default
+    ec2.REGION_WORKERS) at a time.
     """
+    # ec2 imports this module, so its settings can't be read at import time
+    max_workers = max_workers or ec2.REGION_WORKERS
     instance_type_region_availability_zones = {}
-    for region_name in ec2.describe_regions():
-        for offering in ec2.describe_instance_type_offerings(
-            region_name=region_name, location_type="availability-zone-id"
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for region_name, region_azs in executor.map(
+            _region_availability_zones, ec2.describe_regions()
         ):
-            instance_type = offering["InstanceType"]
-            availability_zone_id = offering["Location"]
-            region_availability_zones = instance_type_region_availability_zones.get(
-                instance_type, {}
-            )
-            availability_zones = region_availability_zones.get(region_name, [])
-            if availability_zone_id not in availability_zones:
-                availability_zones.append(availability_zone_id)
-                availability_zones.sort()
-                region_availability_zones[region_name] = availability_zones
-                instance_type_region_availability_zones[
-                    instance_type
-                ] = region_availability_zones
+            for instance_type, availability_zones in region_azs.items():
+                region_availability_zones = instance_type_region_availability_zones.get(
+                    instance_type, {}
+                )
+                region_availability_zones[region_name] = sorted(availability_zones)
+                instance_type_region_availability_zones[instance_type] = (
+                    region_availability_zones
+                )
     for inst in instances:
         inst.availability_zones = instance_type_region_availability_zones.get(
             inst.instance_type, {}
@@ -1040,34 +1061,98 @@ def add_placement_groups(instances):
             inst.placement_group_support = False
 
 
-def scrape(data_file):
+# Every enrichment stage declares the instance data it reads ("requires") and
+# the data it writes ("provides"). Stages only wait on the stages providing
+# their inputs, everything else runs concurrently since most of them spend
+# their time waiting on a single HTTP fetch.
+#
+#   (description, function, requires, provides)
+SCRAPE_STAGES = [
+    ("Parsing pricing info", add_pricing_info, [], ["pricing"]),
+    ("Parsing ENI info", add_eni_info, [], ["vpc"]),
+    ("Parsing EBS info", add_ebs_info, [], ["ebs"]),
+    ("Parsing Linux AMI info", add_linux_ami_info, [], ["virtualization_types"]),
+    ("Parsing VPC-only info", add_vpconly_detail, [], ["vpc_only"]),
+    ("Parsing local instance storage", add_instance_storage_details, [], ["storage"]),
+    ("Parsing burstable instance credits", add_t2_credits, [], ["burst_credits"]),
+    ("Parsing instance names", add_pretty_names, [], ["pretty_name"]),
+    ("Parsing emr details", add_emr_info, ["pricing"], ["emr"]),
+    ("Adding GPU details", add_gpu_info, [], ["gpu"]),
+    ("Adding availability zone details", add_availability_zone_info, [], ["azs"]),
+    ("Adding placement group details", add_placement_groups, [], ["placement"]),
+]
+
+
+def _run_stage(description, func, instances):
+    print("%s..." % description)
+    start = time.perf_counter()
+    func(instances)
+    return time.perf_counter() - start
+
+
+def run_stages(instances, stages, max_workers=SCRAPE_WORKERS):
+    """Run enrichment stages in a thread pool as a dependency graph.
+
+    A stage is started as soon as every stage providing one of its inputs has
+    finished. Returns a list of (description, seconds) in completion order. The
+    first exception raised by a stage is re-raised once running stages finish.
+    """
+    providers = {}
+    for description, _, _, provides in stages:
+        for output in provides:
+            providers.setdefault(output, set()).add(description)
+
+    pending = list(stages)
+    finished = set()
+    running = {}
+    timings = []
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        while pending or running:
+            for stage in list(pending):
+                description, func, requires, _ = stage
+                blocked = any(
+                    providers.get(r, set()) - finished - {description} for r in requires
+                )
+                if not blocked:
+                    pending.remove(stage)
+                    future = executor.submit(_run_stage, description, func, instances)
+                    running[future] = description
+
+            if not running:
+                raise ValueError(
+                    "Unsatisfiable stage dependencies: {}".format(
+                        ", ".join(s[0] for s in pending)
+                    )
+                )
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                description = running.pop(future)
+                timings.append((description, future.result()))
+                finished.add(description)
+
+    return timings
+
+
+def print_stage_timings(timings, elapsed):
+    print("Stage timings:")
+    for description, seconds in sorted(timings, key=lambda t: t[1], reverse=True):
+        print("  {:>8.2f}s  {}".format(seconds, description))
+    print(
+        "  {:>8.2f}s  total wall time ({:.2f}s if run serially)".format(
+            elapsed, sum(t[1] for t in timings)
+        )
+    )
+
+
+def scrape(data_file, max_workers=SCRAPE_WORKERS):
     """Scrape AWS to get instance data"""
+    start = time.perf_counter()
     print("Parsing instance types...")
     all_instances = ec2.get_instances()
-    print("Parsing pricing info...")
-    add_pricing_info(all_instances)
-    print("Parsing ENI info...")
-    add_eni_info(all_instances)
-    print("Parsing EBS info...")
-    add_ebs_info(all_instances)
-    print("Parsing Linux AMI info...")
-    add_linux_ami_info(all_instances)
-    print("Parsing VPC-only info...")
-    add_vpconly_detail(all_instances)
-    print("Parsing local instance storage...")
-    add_instance_storage_details(all_instances)
-    print("Parsing burstable instance credits...")
-    add_t2_credits(all_instances)
-    print("Parsing instance names...")
-    add_pretty_names(all_instances)
-    print("Parsing emr details...")
-    add_emr_info(all_instances)
-    print("Adding GPU details...")
-    add_gpu_info(all_instances)
-    print("Adding availability zone details...")
-    add_availability_zone_info(all_instances)
-    print("Adding placement group details...")
-    add_placement_groups(all_instances)
+    timings = [("Parsing instance types", time.perf_counter() - start)]
+    timings.extend(run_stages(all_instances, SCRAPE_STAGES, max_workers))
+    print_stage_timings(timings, time.perf_counter() - start)
 
     os.makedirs(os.path.dirname(data_file), exist_ok=True)
     with open(data_file, "w+") as f:
@@ -0,0 +1,81 @@
+# Copied to ec2instances/info/__init__.py by scripts/package.py.
+#
+# The EC2 and RDS datasets ship next to this module as gzipped JSON lines, a
+# list of the instance types on the first line and then one instance per line.
+# Importing the package reads nothing. A dataset is read the first time it is
+# used, and an instance is only decoded once it is accessed:
+#
+#   from ec2instances.info import ec2, rds
+#   ec2.get("m5.large")["vCPU"]
+#   [i["instance_type"] for i in rds if i["vcpu"] == "2"]
+import gzip
+import json
+import os
+import threading
+from collections.abc import Sequence
+
+DATA_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+class LazyInstances(Sequence):
+    """The instances of a dataset, as a read-only list of dicts"""
+
+    def __init__(self, name):
+        self.name = name
+        self._lock = threading.Lock()
+        self._lines = None
+
+    def _load(self):
+        if self._lines is None:
+            with self._lock:
+                if self._lines is None:
+                    path = os.path.join(DATA_DIR, self.name + ".jsonl.gz")
+                    with gzip.open(path, "rb") as f:
+                        lines = f.read().splitlines()
+                    self._index = {t: n for n, t in enumerate(json.loads(lines[0]))}
+                    self._records = [None] * (len(lines) - 1)
+                    self._lines = lines[1:]
+        return self._lines
+
+    def _record(self, n):
+        record = self._records[n]
+        if record is None:
+            record = self._records[n] = json.loads(self._lines[n])
+        return record
+
+    def __len__(self):
+        return len(self._load())
+
+    def __getitem__(self, n):
+        self._load()
+        if isinstance(n, slice):
+            return [self._record(i) for i in range(*n.indices(len(self._records)))]
+        if n < 0:
+            n += len(self._records)
+        if not 0 <= n < len(self._records):
+            raise IndexError("instance index out of range")
+        return self._record(n)
+
+    def get(self, instance_type, default=None):
+        """The instance of type instance_type, or default"""
+        self._load()
+        n = self._index.get(instance_type)
+        return default if n is None else self._record(n)
+
+    def instance_types(self):
+        """All instance types, in dataset order"""
+        self._load()
+        return list(self._index)
+
+    def __contains__(self, item):
+        if isinstance(item, str):
+            self._load()
+            return item in self._index
+        return Sequence.__contains__(self, item)
+
+    def __repr__(self):
+        return "<LazyInstances %s>" % self.name
+
+
+ec2 = LazyInstances("ec2")
+rds = LazyInstances("rds")
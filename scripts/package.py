@@ -1,7 +1,8 @@
 #!/usr/bin/env python
 
-import pprint
+import gzip
 import json
+import shutil
 import subprocess
 
 root_dir = (
@@ -13,26 +14,28 @@ def path(s):
     return "{}/{}".format(root_dir, s)
 
 
+def write_dataset(data_file, output_file):
+    # One line with the instance types, then one line per instance, see
+    # scripts/lazy_data.py for how they are read
+    with open(data_file, "r") as input:
+        instances = json.loads(input.read())
+    with gzip.open(output_file, "wt", encoding="utf-8") as output:
+        output.write(json.dumps([i["instance_type"] for i in instances]))
+        for i in instances:
+            output.write("\n")
+            output.write(json.dumps(i, separators=(",", ":")))
+
+
 # Create the output directory
 subprocess.call(["mkdir", "-p", path("ec2instances/info")])
 # Make the project a module
 subprocess.call(["touch", path("ec2instances/__init__.py")])
 
-
-with open(path("ec2instances/info/__init__.py"), "w+") as output:
-    # Final output will look like the following, though pretty-printed:
-    #
-    #  ec2 = [{'instance_type': 't2.micro', ...}, ...]
-    #  rds = [{'instance_type': 'db.t2.small', ...}, ...]
-    #
-    with open(path("www/instances.json"), "r") as input:
-        ec2 = json.loads(input.read())
-        output.write("ec2 = {}".format(pprint.pformat(ec2)))
-
-    output.write("\n")
-
-    with open(path("www/rds/instances.json"), "r") as input:
-        rds = json.loads(input.read())
-        output.write("rds = {}".format(pprint.pformat(rds)))
-
-    output.write("\n")
+# The package module only loads the data when it is first used, as
+#
+#  ec2 = [{'instance_type': 't2.micro', ...}, ...]
+#  rds = [{'instance_type': 'db.t2.small', ...}, ...]
+#
+shutil.copyfile(path("scripts/lazy_data.py"), path("ec2instances/info/__init__.py"))
+write_dataset(path("www/instances.json"), path("ec2instances/info/ec2.jsonl.gz"))
+write_dataset(path("www/rds/instances.json"), path("ec2instances/info/rds.jsonl.gz"))
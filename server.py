@@ -0,0 +1,147 @@
+# The HTTP server behind `invoke serve`, good enough to run a mirror of the site.
+#
+# Requests are handled by a thread each. Files are sent precompressed when the
+# client accepts one of the variants written by compress.py, with an ETag and
+# Last-Modified so that clients can revalidate them with a 304. The bodies of
+# recently sent files are kept in memory, up to SERVE_CACHE_MB.
+import collections
+import email.utils
+import hashlib
+import http.server
+import os
+import threading
+from io import BytesIO
+
+import compress
+
+SERVE_CACHE_MB = int(os.getenv("SERVE_CACHE_MB", "256"))
+
+
+class FileCache(object):
+    """The bodies of recently read files, least recently used evicted first"""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.size = 0
+        # path -> (stat key, body, etag)
+        self.entries = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, path):
+        """The body and ETag of the file at path"""
+        st = os.stat(path)
+        key = (st.st_mtime_ns, st.st_size)
+        with self.lock:
+            entry = self.entries.get(path)
+            if entry is not None and entry[0] == key:
+                self.entries.move_to_end(path)
+                return entry[1], entry[2]
+
+        with open(path, "rb") as f:
+            body = f.read()
+        etag = '"%s"' % hashlib.sha1(body).hexdigest()
+        # Files that take up a good part of the cache would evict everything else
+        if len(body) <= self.max_bytes // 4:
+            with self.lock:
+                old = self.entries.pop(path, None)
+                if old is not None:
+                    self.size -= len(old[1])
+                self.entries[path] = (key, body, etag)
+                self.size += len(body)
+                while self.size > self.max_bytes:
+                    _, (_, evicted, _) = self.entries.popitem(last=False)
+                    self.size -= len(evicted)
+        return body, etag
+
+
+class Handler(http.server.SimpleHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    cache = None
+
+    def _fix_path(self):
+        # The URL does not include ".html". Add it to serve the file for dev
+        path, sep, query = self.path.partition("?")
+        if "/aws/" in path and not path.endswith((".html", "/")):
+            self.path = path + ".html" + sep + query
+
+    def do_GET(self):
+        self._fix_path()
+        super().do_GET()
+
+    def do_HEAD(self):
+        self._fix_path()
+        super().do_HEAD()
+
+    def _not_modified(self, etag, mtime):
+        if_none_match = self.headers.get("If-None-Match")
+        if if_none_match is not None:
+            tags = [t.strip() for t in if_none_match.split(",")]
+            return "*" in tags or etag in tags or "W/" + etag in tags
+        if_modified_since = self.headers.get("If-Modified-Since")
+        if if_modified_since is not None:
+            try:
+                since = email.utils.parsedate_to_datetime(if_modified_since)
+            except (TypeError, ValueError):
+                return False
+            return int(mtime) <= since.timestamp()
+        return False
+
+    def send_head(self):
+        path = self.translate_path(self.path)
+        if os.path.isdir(path) and self.path.partition("?")[0].endswith("/"):
+            path = os.path.join(path, "index.html")
+        if not os.path.isfile(path):
+            # Redirects, directory listings and errors
+            return super().send_head()
+
+        send_path, encoding = compress.negotiate(
+            path, self.headers.get("Accept-Encoding")
+        )
+        try:
+            body, etag = self.cache.get(send_path)
+            mtime = os.path.getmtime(path)
+        except OSError:
+            self.send_error(404, "File not found")
+            return None
+
+        if self._not_modified(etag, mtime):
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.send_header("Vary", "Accept-Encoding")
+            self.end_headers()
+            return None
+
+        self.send_response(200)
+        self.send_header("Content-Type", self.guess_type(path))
+        if encoding:
+            self.send_header("Content-Encoding", encoding)
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("ETag", etag)
+        self.send_header("Last-Modified", self.date_time_string(mtime))
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Vary", "Accept-Encoding")
+        self.end_headers()
+        return BytesIO(body)
+
+
+def serve(root_dir, host, port, cache_mb=SERVE_CACHE_MB):
+    """Serve root_dir on host:port until interrupted"""
+    directory = os.path.abspath(root_dir)
+
+    class RootHandler(Handler):
+        cache = FileCache(cache_mb * 1024 * 1024)
+
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, directory=directory, **kwargs)
+
+    httpd = http.server.ThreadingHTTPServer((host, port), RootHandler)
+    httpd.daemon_threads = True
+    print(
+        "Serving on http://{}:{}".format(
+            httpd.socket.getsockname()[0], httpd.socket.getsockname()[1]
+        )
+    )
+    try:
+        httpd.serve_forever()
+    finally:
+        httpd.server_close()
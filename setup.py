@@ -2,10 +2,10 @@
 from __future__ import unicode_literals
 from setuptools import setup
 
-
 setup(
     name="ec2instances.info",
     packages=["ec2instances.info"],
+    package_data={"ec2instances.info": ["*.jsonl.gz"]},
     version="0.0.2",
     description="The community-maintained dataset of aws instance types" " and pricing",
     author="Garret Heaton",
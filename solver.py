@@ -0,0 +1,199 @@
+# The k cheapest instance types that fit given resource requirements.
+#
+#   solver = CheapestFit.load("www/instances.json")
+#   solver.cheapest("eu-west-1", vCPU=16, memory=64, nvme=500, k=3)
+#   solver.cheapest("us-east-1", term="yrTerm1Standard.noUpfront", arch="arm64")
+#
+# The instances priced for a region, platform and term are kept sorted by
+# price, less those that can never be among the MAX_K cheapest fits: an
+# instance with at least MAX_K cheaper instances that have as much or more of
+# every resource (and its architectures) always has MAX_K better fits. What is
+# left is the frontier of the region, platform and term, usually a small part
+# of the instances, and a query returns the first k entries of it that fit.
+#
+# Frontiers are built on first use. refresh() reloads instances.json when it
+# changed and only rebuilds the frontiers whose instances or prices changed.
+import json
+import os
+import threading
+
+import query
+from network import network_sort
+
+# The most instance types a query can ask for from the frontier, queries for
+# more fall back to all instances of the region, platform and term
+MAX_K = 10
+
+# Resources an instance offers, in the order of Candidate.resources
+RESOURCES = ("vCPU", "memory", "GPU", "nvme", "network")
+
+
+def nvme_gb(instance):
+    """Total local NVMe storage of instance in GB"""
+    storage = instance.get("storage")
+    if not storage or not storage.get("nvme_ssd"):
+        return 0
+    size = (storage.get("devices") or 0) * (storage.get("size") or 0)
+    return size * 1000 if storage.get("size_unit") == "TB" else size
+
+
+def network_tier(network):
+    """network as a network_sort() value, network may be a network_sort()
+    value or a network_performance like "25 Gigabit"
+    """
+    if isinstance(network, str):
+        return network_sort({"network_performance": network})
+    return network
+
+
+def resources(instance):
+    return (
+        instance.get("vCPU") or 0,
+        instance.get("memory") or 0,
+        instance.get("GPU") or 0,
+        nvme_gb(instance),
+        network_sort(instance),
+    )
+
+
+class Candidate(object):
+    """An instance type with its price in a region, platform and term"""
+
+    __slots__ = ("price", "instance_type", "resources", "arch")
+
+    def __init__(self, price, instance_type, resources, arch):
+        self.price = price
+        self.instance_type = instance_type
+        self.resources = resources
+        self.arch = arch
+
+    def key(self):
+        return (self.price, self.instance_type, self.resources, self.arch)
+
+    def dominates(self, other):
+        """Whether self fits everything other fits"""
+        return self.arch >= other.arch and all(
+            a >= b for a, b in zip(self.resources, other.resources)
+        )
+
+    def fits(self, required, arch):
+        return (arch is None or arch in self.arch) and all(
+            a >= b for a, b in zip(self.resources, required)
+        )
+
+
+def frontier(candidates, max_k=MAX_K):
+    """The candidates, sorted by price, that can be among the max_k cheapest
+    fits of some requirements"""
+    kept = []
+    for c in candidates:
+        dominated = 0
+        # Dropped candidates have max_k dominators among the kept ones, which
+        # dominate c as well if they do, so comparing with those is enough
+        for other in kept:
+            if other.dominates(c):
+                dominated += 1
+                if dominated == max_k:
+                    break
+        if dominated < max_k:
+            kept.append(c)
+    return kept
+
+
+class CheapestFit(object):
+    """Answers cheapest() from the frontiers of the given instances"""
+
+    def __init__(self, instances, data_file=None):
+        self.data_file = data_file
+        self._stat = None
+        self._lock = threading.Lock()
+        # (region, platform, term) -> (candidates, frontier)
+        self._frontiers = {}
+        self._set_instances(instances)
+
+    @classmethod
+    def load(cls, data_file):
+        solver = cls([], data_file)
+        solver.refresh()
+        return solver
+
+    def _set_instances(self, instances):
+        self.instances = instances
+        self._resources = [resources(i) for i in instances]
+        self._arch = [frozenset(i.get("arch") or []) for i in instances]
+
+    def refresh(self):
+        """Reload data_file if it changed since it was loaded.
+
+        Frontiers whose candidates are the same in the new data are kept.
+        Returns whether data_file was reloaded and the number of frontiers
+        that were rebuilt, as a (reloaded, rebuilt) pair.
+        """
+        st = os.stat(self.data_file)
+        stat = (st.st_mtime_ns, st.st_size)
+        if stat == self._stat:
+            return False, 0
+        with open(self.data_file, "r") as f:
+            instances = json.load(f)
+        with self._lock:
+            self._set_instances(instances)
+            self._stat = stat
+            rebuilt = 0
+            for key, (candidates, _) in list(self._frontiers.items()):
+                new_candidates = self._candidates(*key)
+                if [c.key() for c in new_candidates] != [c.key() for c in candidates]:
+                    self._frontiers[key] = (new_candidates, frontier(new_candidates))
+                    rebuilt += 1
+        return True, rebuilt
+
+    def _candidates(self, region, platform, term):
+        candidates = []
+        for n, i in enumerate(self.instances):
+            p = query.price(i, region, platform, term)
+            if p is not None:
+                candidates.append(
+                    Candidate(p, i["instance_type"], self._resources[n], self._arch[n])
+                )
+        candidates.sort(key=lambda c: (c.price, c.instance_type))
+        return candidates
+
+    def _frontier(self, region, platform, term):
+        key = (region, platform, term)
+        entry = self._frontiers.get(key)
+        if entry is None:
+            with self._lock:
+                entry = self._frontiers.get(key)
+                if entry is None:
+                    candidates = self._candidates(region, platform, term)
+                    entry = self._frontiers[key] = (candidates, frontier(candidates))
+        return entry
+
+    def cheapest(
+        self,
+        region,
+        platform="linux",
+        term="ondemand",
+        k=1,
+        vCPU=0,
+        memory=0,
+        GPU=0,
+        nvme=0,
+        network=0,
+        arch=None,
+    ):
+        """The k cheapest instance types with at least the given resources, as
+        (instance type, price) pairs, cheapest first.
+
+        nvme is local NVMe storage in GB and network a network_sort() value or
+        a network_performance. term is "ondemand", "spot_min", "spot_max" or a
+        reserved term like "yrTerm1Standard.noUpfront".
+        """
+        candidates, front = self._frontier(region, platform, term)
+        required = (vCPU, memory, GPU, nvme, network_tier(network))
+        fits = []
+        for c in front if k <= MAX_K else candidates:
+            if c.fits(required, arch):
+                fits.append((c.instance_type, c.price))
+                if len(fits) == k:
+                    break
+        return fits
@@ -8,22 +8,16 @@ import traceback
 
 from boto import connect_s3
 from boto.s3.connection import OrdinaryCallingFormat
-from boto.s3.key import Key
 from invoke import task
 from invocations.console import confirm
-from six.moves import SimpleHTTPServer, socketserver
 
 from rds import scrape as rds_scrape
 from cache import scrape as cache_scrape
-from render import render
-from render import build_sitemap
-from render import about_page
+from render import render_all
+import s3sync
+import server
 from scrape import scrape
 
-from io import BytesIO
-import gzip
-import shutil
-
 BUCKET_NAME = "www.ec2instances.info"
 
 # Work around https://github.com/boto/boto/issues/2836 by explicitly setting
@@ -81,37 +75,28 @@ def scrape_cache(c):
 
 @task
 def serve(c):
-    class MyHandler(SimpleHTTPServer.SimpleHTTPRequestHandler):
-        def do_GET(self):
-            # The URL does not include ".html". Add it to serve the file for dev
-            if "/aws/" in self.path:
-                self.path += ".html"
-            SimpleHTTPServer.SimpleHTTPRequestHandler.do_GET(self)
-
     """Serve site contents locally for development"""
-    os.chdir("www/")
-    httpd = socketserver.TCPServer((HTTP_HOST, int(HTTP_PORT)), MyHandler)
-    print(
-        "Serving on http://{}:{}".format(
-            httpd.socket.getsockname()[0], httpd.socket.getsockname()[1]
-        )
-    )
-    httpd.serve_forever()
+    server.serve("www", HTTP_HOST, int(HTTP_PORT))
 
 
 @task
 def render_html(c):
     """Render HTML but do not update data from Amazon"""
-    sitemap = []
-    sitemap.extend(render("www/instances.json", "in/index.html.mako", "www/index.html"))
-    sitemap.extend(
-        render("www/rds/instances.json", "in/rds.html.mako", "www/rds/index.html")
-    )
-    sitemap.extend(
-        render("www/cache/instances.json", "in/cache.html.mako", "www/cache/index.html")
-    )
-    sitemap.append(about_page())
-    build_sitemap(sitemap)
+    render_all()
+
+
+@task
+def benchmark(c, scales=None, output=None):
+    """Benchmark scraping and rendering on synthetic data"""
+    # Only loaded for this task, it pulls in everything it benchmarks
+    import benchmark as benchmarks
+
+    argv = []
+    if scales:
+        argv += ["--scales", scales]
+    if output:
+        argv += ["--output", output]
+    exit(benchmarks.main(argv))
 
 
 @task
@@ -135,34 +120,9 @@ def bucket_delete(c):
 
 
 @task
-def deploy(c, root_dir="www"):
-    """Deploy current content"""
-    conn = connect_s3(calling_format=BUCKET_CALLING_FORMAT)
-    bucket = conn.get_bucket(BUCKET_NAME)
-
-    for root, dirs, files in os.walk(root_dir):
-        for name in files:
-            if name.startswith("."):
-                continue
-            local_path = os.path.join(root, name)
-            remote_path = local_path[len(root_dir) + 1 :]
-            print("%s -> %s/%s" % (local_path, BUCKET_NAME, remote_path))
-            k = Key(bucket)
-            k.key = remote_path
-
-            if name.endswith(".html"):
-                upload_file = BytesIO()
-                with gzip.GzipFile(fileobj=upload_file, mode="wb") as gz, open(
-                    local_path, "rb"
-                ) as fp:
-                    shutil.copyfileobj(fp, gz)
-                upload_file.seek(0)
-                k.set_metadata("Content-Type", "text/html")
-                k.set_metadata("Content-Encoding", "gzip")
-            else:
-                upload_file = open(local_path, "rb")
-
-            k.set_contents_from_file(upload_file, policy="public-read")
+def deploy(c, root_dir="www", delete=False, workers=s3sync.UPLOAD_WORKERS):
+    """Deploy current content, uploading only what changed"""
+    s3sync.sync(root_dir, BUCKET_NAME, workers=int(workers), delete=delete)
 
 
 @task(default=True)
@@ -0,0 +1,30 @@
+# The Mako templates of all pages, looked up through one shared lookup.
+#
+# Templates are compiled to Python modules in TEMPLATE_CACHE_DIR, named after a
+# hash of their source. A build, or a render worker, only compiles a template
+# when its source changed since it was last compiled and otherwise imports the
+# compiled module. Within a process every template is loaded once, by
+# get_template(), and reused by all pages rendered with it.
+import hashlib
+import os
+
+import mako.lookup
+
+TEMPLATE_CACHE_DIR = os.getenv("TEMPLATE_CACHE_DIR", ".template-cache")
+
+
+def _module_filename(filename, uri):
+    with open(filename, "rb") as f:
+        digest = hashlib.sha256(f.read()).hexdigest()[:16]
+    name = uri.strip("/").replace("/", "_").replace(".", "_")
+    return os.path.join(TEMPLATE_CACHE_DIR, "%s_%s.py" % (name, digest))
+
+
+_lookup = mako.lookup.TemplateLookup(
+    directories=["."], modulename_callable=_module_filename
+)
+
+
+def get_template(template_file):
+    """The template at template_file, relative to the repository root"""
+    return _lookup.get_template("/" + template_file)
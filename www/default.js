@@ -230,6 +230,12 @@ $(document).ready(function () {
   init_data_table();
 });
 
+// Whether a get_pricing() result is a price. A price of 0 is one, so this
+// must not test truthiness.
+function is_price(v) {
+  return v !== undefined && v !== null && v !== '' && !isNaN(v);
+}
+
 function change_cost() {
   // update pricing duration menu text
   var duration = g_settings.cost_duration;
@@ -271,8 +277,7 @@ function change_cost() {
       'ondemand',
     );
     if (
-      per_time &&
-      !isNaN(per_time) &&
+      is_price(per_time) &&
       !isNaN(pricing_unit_modifier) &&
       pricing_unit_modifier > 0
     ) {
@@ -296,8 +301,7 @@ function change_cost() {
       g_settings.reserved_term,
     );
     if (
-      per_time &&
-      !isNaN(per_time) &&
+      is_price(per_time) &&
       !isNaN(pricing_unit_modifier) &&
       pricing_unit_modifier > 0
     ) {
@@ -320,8 +324,7 @@ function change_cost() {
       'spot_min',
     );
     if (
-      per_time &&
-      !isNaN(per_time) &&
+      is_price(per_time) &&
       !isNaN(pricing_unit_modifier) &&
       pricing_unit_modifier > 0
     ) {
@@ -344,8 +347,7 @@ function change_cost() {
       'spot_max',
     );
     if (
-      per_time &&
-      !isNaN(per_time) &&
+      is_price(per_time) &&
       !isNaN(pricing_unit_modifier) &&
       pricing_unit_modifier > 0
     ) {
@@ -363,8 +365,7 @@ function change_cost() {
     }
     per_time = get_pricing(elem.closest('tr').attr('id'), g_settings.region, 'ebs');
     if (
-      per_time &&
-      !isNaN(per_time) &&
+      is_price(per_time) &&
       !isNaN(pricing_unit_modifier) &&
       pricing_unit_modifier > 0
     ) {
@@ -382,8 +383,7 @@ function change_cost() {
     }
     per_time = get_pricing(elem.closest('tr').attr('id'), g_settings.region, 'emr', 'emr');
     if (
-      per_time &&
-      !isNaN(per_time) &&
+      is_price(per_time) &&
       !isNaN(pricing_unit_modifier) &&
       pricing_unit_modifier > 0
     ) {
@@ -606,7 +606,12 @@ function on_data_table_initialized() {
 
   change_region(g_settings.region);
   change_reserved_term(g_settings.reserved_term);
-  change_cost();
+  if (has_pricing(g_settings.region)) {
+    change_cost();
+  } else {
+    // the prices of the region are not in the page, fetch them first
+    load_pricing(g_settings.region, redraw_costs);
+  }
 
   $.extend($.fn.dataTableExt.oStdClasses, {
     sWrapper: 'dataTables_wrapper form-inline',
@@ -659,9 +664,19 @@ function on_data_table_initialized() {
     redraw_costs();
   });
 
+  // the prices of regions clicked one after the other can arrive in any
+  // order, only the region clicked last is selected
+  var clicked_region = null;
   $('#region-dropdown li').bind('click', function (e) {
-    change_region($(e.target).data('region'));
-    redraw_costs();
+    var region = $(e.target).data('region');
+    clicked_region = region;
+    load_pricing(region, function () {
+      if (region !== clicked_region) {
+        return;
+      }
+      change_region(region);
+      redraw_costs();
+    });
   });
 
   $('#reserved-term-dropdown li').bind('click', function (e) {